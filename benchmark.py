@@ -0,0 +1,470 @@
+"""Playback engine benchmarks on synthetic MIDI files.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --quick
+
+Generates stress-test MIDI files with mido, then measures parse time,
+compile time, per-event note mapping cost for every range mode, plan
+memory for a 1M-event plan, scheduler lateness, sustained keys/sec
+through the null output backend, polyphony reduction, track selection
+and library search latency. Results are printed and can be written as
+JSON to compare versions.
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+from itertools import islice
+import mido
+from midiplayer import MidiPlayer
+from midistream import MidiNoteStream, MidiParts
+from midicompiler import (
+    compile_midi, build_note_table, map_note, find_optimal_range, find_best_transposition, RANGE_MODES
+)
+from keyoutput import NullBackend, RecordingBackend, build_batches
+from scheduler import PlaybackClock
+from libraryindex import LibraryIndex, SORT_KEYS
+from libraryscan import CACHED_BATCH_SIZE
+from compatibility import KeymapCompatibility
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TICKS_PER_BEAT = 480
+LIBRARY_WORDS = ("piano theme song night river dream moon light battle waltz sonata nocturne etude fantasy "
+                 "march love rain snow fire star ocean city forest memory winter summer spring hero boss").split()
+# Typed one key at a time, then a few fresh queries
+LIBRARY_QUERIES = ("p", "pi", "pia", "pian", "piano", "piano ", "piano n", "piano ni", "piano nig",
+                   "e", "x", "mo", "12", "moon light 1", "summer winter")
+# A 21-key instrument that drops fast input
+REDUCTION_OPTIONS = {'max_polyphony': 4, 'max_keys_per_sec': 25, 'reduce_density': True}
+
+
+def _new_midi(tracks=1):
+    midi = mido.MidiFile(ticks_per_beat=TICKS_PER_BEAT)
+    for _ in range(tracks):
+        midi.tracks.append(mido.MidiTrack())
+    midi.tracks[0].append(mido.MetaMessage('set_tempo', tempo=500000, time=0))
+    return midi
+
+
+def _add_notes(track, notes, rng, gap_ticks, length_ticks, channel=0):
+    """Append (start offset, [pitches]) groups as note_on/note_off pairs."""
+    pending = 0
+    for pitches in notes:
+        for index, pitch in enumerate(pitches):
+            track.append(mido.Message('note_on', note=pitch, velocity=rng.randint(40, 120),
+                                      channel=channel, time=pending if index == 0 else 0))
+            pending = 0
+        for index, pitch in enumerate(pitches):
+            track.append(mido.Message('note_off', note=pitch, velocity=0, channel=channel,
+                                      time=length_ticks if index == 0 else 0))
+        pending = gap_ticks
+
+
+def generate_dense_chords(path, chords=3000, size=10, seed=1):
+    rng = random.Random(seed)
+    midi = _new_midi()
+    groups = [rng.sample(range(36, 96), size) for _ in range(chords)]
+    _add_notes(midi.tracks[0], groups, rng, gap_ticks=60, length_ticks=60)
+    midi.save(path)
+
+
+def generate_trills(path, notes=20000, seed=2):
+    rng = random.Random(seed)
+    midi = _new_midi()
+    base = rng.randint(55, 70)
+    groups = [[base + (index % 2) * 2] for index in range(notes)]
+    _add_notes(midi.tracks[0], groups, rng, gap_ticks=10, length_ticks=20)
+    midi.save(path)
+
+
+def generate_large(path, events=120000, seed=3):
+    rng = random.Random(seed)
+    midi = _new_midi()
+    groups = [[rng.randint(24, 108)] for _ in range(events // 2)]
+    _add_notes(midi.tracks[0], groups, rng, gap_ticks=15, length_ticks=15)
+    midi.save(path)
+
+
+def generate_tempo_changes(path, changes=3000, seed=4):
+    rng = random.Random(seed)
+    midi = _new_midi()
+    track = midi.tracks[0]
+    for _ in range(changes):
+        track.append(mido.MetaMessage('set_tempo', tempo=rng.randint(250000, 1000000), time=0))
+        pitch = rng.randint(48, 84)
+        track.append(mido.Message('note_on', note=pitch, velocity=90, time=0))
+        track.append(mido.Message('note_off', note=pitch, velocity=0, time=120))
+    midi.save(path)
+
+
+def generate_multitrack(path, tracks=16, notes_per_track=2000, seed=5):
+    rng = random.Random(seed)
+    midi = _new_midi(tracks)
+    for index, track in enumerate(midi.tracks):
+        groups = [[rng.randint(30, 100)] for _ in range(notes_per_track)]
+        _add_notes(track, groups, rng, gap_ticks=rng.choice((30, 60, 120)), length_ticks=30, channel=index % 16)
+    midi.save(path)
+
+
+def generate_timing(path, seconds=5.0, seed=6):
+    """Short file with 5 ms steps and chords, for realtime lateness measurement."""
+    rng = random.Random(seed)
+    midi = _new_midi()
+    steps = int(seconds / 0.01)
+    groups = [rng.sample(range(48, 84), rng.choice((1, 1, 2, 4))) for _ in range(steps)]
+    _add_notes(midi.tracks[0], groups, rng, gap_ticks=5, length_ticks=5)
+    midi.save(path)
+
+
+SCENARIOS = {
+    'dense_chords': generate_dense_chords,
+    'trills': generate_trills,
+    'large': generate_large,
+    'tempo_changes': generate_tempo_changes,
+    'multitrack': generate_multitrack,
+}
+
+QUICK_ARGS = {
+    'dense_chords': {'chords': 300},
+    'trills': {'notes': 2000},
+    'large': {'events': 12000},
+    'tempo_changes': {'changes': 300},
+    'multitrack': {'notes_per_track': 200},
+}
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+
+    def pick(fraction):
+        return values[min(len(values) - 1, int(len(values) * fraction))]
+
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'max': values[-1]}
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def peak_memory_kb(function, *args):
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def drain_stream(path):
+    count = 0
+    for _ in MidiNoteStream(path):
+        count += 1
+    return count
+
+
+def note_events(midi):
+    return [msg.note for msg in midi if msg.type == 'note_on' and msg.velocity > 0]
+
+
+def bench_mapping(notes, keymap):
+    """ns per note event for table lookup vs. the per-event map_note path."""
+    histogram = [0] * 128
+    for note in notes:
+        histogram[note] += 1
+    old_min, old_max = min(notes), max(notes)
+    results = {}
+    for mode in RANGE_MODES:
+        low, high = old_min, old_max
+        transpose = 0
+        search_s = 0.0
+        if mode == 6:
+            (low, high), search_s = timed(find_optimal_range, histogram, keymap.min_note, keymap.max_note)
+        elif mode == 7:
+            transpose, search_s = timed(find_best_transposition, histogram, keymap.notes)
+        table, build_s = timed(build_note_table, keymap, mode, low, high, transpose, True)
+        start = time.perf_counter_ns()
+        for note in notes:
+            table[note]
+        table_ns = (time.perf_counter_ns() - start) / len(notes)
+        start = time.perf_counter_ns()
+        for note in notes:
+            map_note(note, keymap, mode, low, high, keymap.min_note, keymap.max_note, transpose, True)
+        map_note_ns = (time.perf_counter_ns() - start) / len(notes)
+        results[str(mode)] = {
+            'search_ms': search_s * 1000,
+            'table_build_ms': build_s * 1000,
+            'table_ns_per_event': table_ns,
+            'map_note_ns_per_event': map_note_ns,
+        }
+    return results
+
+
+def bench_send_loop(plan):
+    """Raw key events/sec through NullBackend for the wait-and-send hot loop alone."""
+    backend = NullBackend()
+    batches = [(batch_time, backend.prepare(sequence)) for batch_time, sequence in build_batches(plan)]
+    clock = PlaybackClock(realtime=False)
+    send = backend.send
+    start = time.perf_counter()
+    clock.start()
+    for batch_time, inputs in batches:
+        deadline_ns = clock.deadline_ns(batch_time)
+        clock.wait_until(deadline_ns)
+        send(inputs, deadline_ns)
+    elapsed = time.perf_counter() - start
+    return backend.sent_events / elapsed if elapsed else 0
+
+
+def make_player(workdir, backend):
+    player = MidiPlayer(keymap_file=os.path.join(BASE_DIR, 'keymap.json'),
+                        settings_file=os.path.join(workdir, 'settings.json'),
+                        cache_file=os.path.join(workdir, 'midi_cache.json'),
+                        output_backend=backend)
+    player.settings.update(midi_directories=[workdir], countdown_duration=0,
+                           speed_multiplier=1.0, target_duration=None,
+                           playback_report_file=os.path.join(workdir, 'playback_report.json'))
+    return player
+
+
+def bench_scenario(path, player, keymap):
+    midi, parse_s = timed(mido.MidiFile, path)
+    _, stream_s = timed(drain_stream, path)
+    notes = note_events(midi)
+    plan, compile_s = timed(compile_midi, path, keymap, 3)
+    player.output.sent_events = 0
+    completed, play_s = timed(player.play_midi, os.path.basename(path))
+    sent = player.output.sent_events
+    return {
+        'note_events': len(notes),
+        'plan_events': len(plan),
+        'parse_s': parse_s,
+        'stream_s': stream_s,
+        'parse_peak_kb': peak_memory_kb(lambda: list(mido.MidiFile(path))),
+        'stream_peak_kb': peak_memory_kb(drain_stream, path),
+        'compile_s': compile_s,
+        'null_play_s': play_s,
+        'null_play_keys_per_sec': sent / play_s if play_s and completed else 0,
+        'null_loop_keys_per_sec': bench_send_loop(plan),
+        'mapping': bench_mapping(notes, keymap),
+        'reduction': bench_reduction(path, keymap),
+        'selection': bench_selection(path, keymap),
+    }
+
+
+def bench_selection(path, keymap):
+    """Recompiling with the first track left out: from decoded parts vs. from the file."""
+    parts, decode_s = timed(MidiParts, path)
+    _, file_s = timed(compile_midi, path, keymap, 3, None, 1.0, {0})
+    _, parts_s = timed(compile_midi, parts, keymap, 3, None, 1.0, {0})
+    return {'decode_s': decode_s, 'file_compile_s': file_s, 'parts_compile_s': parts_s, 'parts_bytes': parts.nbytes}
+
+
+def bench_reduction(path, keymap):
+    """Notes kept by polyphony reduction vs. the plain input budget at the same keys/sec."""
+    budget_plan, budget_s = timed(compile_midi, path, keymap, 3,
+                                  {'max_keys_per_sec': REDUCTION_OPTIONS['max_keys_per_sec']})
+    plan, reduce_s = timed(compile_midi, path, keymap, 3, REDUCTION_OPTIONS)
+    return {
+        'budget_compile_s': budget_s,
+        'budget_kept': len(budget_plan) // 2,
+        'budget_dropped': budget_plan.dropped,
+        'compile_s': reduce_s,
+        'kept': len(plan) // 2,
+        'reduced': plan.reduced,
+        'dropped': plan.dropped,
+    }
+
+
+def bench_lateness(path, keymap_name, workdir, spin_budget_ms):
+    recorder = RecordingBackend(realtime=True)
+    player = make_player(workdir, recorder)
+    player.settings['spin_budget_ms'] = spin_budget_ms
+    player.set_keymap(keymap_name)
+    player.play_midi(os.path.basename(path))
+    player.flush_settings()
+    lateness_us = [(sent - deadline) / 1000 for deadline, sent, _, _ in recorder.events()]
+    return {'spin_budget_ms': spin_budget_ms, 'events': len(lateness_us), 'lateness_us': percentiles(lateness_us),
+            'report': player.last_report.to_dict() if player.last_report else None}
+
+
+def bench_plan_storage(path, keymap):
+    """Plan memory and iteration cost: typed columns vs. one PlanEvent tuple per event."""
+    plan, compile_s = timed(compile_midi, path, keymap, 2)
+    tracemalloc.start()
+    events = plan.events
+    tuple_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter_ns()
+    for _, _, flags in plan:
+        pass
+    columns_ns = (time.perf_counter_ns() - start) / len(plan)
+    start = time.perf_counter_ns()
+    for _, _, flags in events:
+        pass
+    tuples_ns = (time.perf_counter_ns() - start) / len(plan)
+    del events
+    return {
+        'plan_events': len(plan),
+        'compile_s': compile_s,
+        'columns_bytes': plan.nbytes,
+        'tuples_bytes': tuple_bytes,
+        'columns_iter_ns_per_event': columns_ns,
+        'tuples_iter_ns_per_event': tuples_ns,
+    }
+
+
+def bench_library_search(keymaps, entries=50000, seed=7):
+    """Library index build time, keymap scoring and filter latency per keystroke, for every sort order.
+
+    Half the files are scanned up front; the rest arrive in scan batches between keystrokes, as they do
+    while the GUI scans a new library.
+    """
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < entries:
+        words = " ".join(rng.choice(LIBRARY_WORDS).title() for _ in range(rng.randint(2, 5)))
+        names.add(f"{words} {rng.randint(1, 999)}.mid")
+    compatibility = KeymapCompatibility(keymaps)
+    library = LibraryIndex(len(compatibility.names))
+    start = time.perf_counter()
+    for name in names:
+        library.add(name)
+    build_s = time.perf_counter() - start
+    infos = []
+    scores_s = 0.0
+    for name in names:
+        low = rng.randint(30, 60)
+        histogram = [0] * 128
+        for _ in range(40):
+            histogram[rng.randint(low, low + 40)] += rng.randint(1, 50)
+        start = time.perf_counter()
+        row = compatibility.scores(histogram)
+        best_column = compatibility.best(row)
+        scores_s += time.perf_counter() - start
+        infos.append(({'filename': name, 'duration': rng.uniform(30, 300), 'note_range': (low, low + 40)},
+                      row, best_column))
+    for info in infos[:entries // 2]:
+        library.set_info(*info)
+    sort_s = {sort_key: timed(library.order, sort_key, 0)[1] for sort_key in SORT_KEYS}
+    pending = iter(infos[entries // 2:])
+    filter_ms = []
+    scan_batch_ms = []
+    for sort_key in SORT_KEYS:
+        for query in LIBRARY_QUERIES:
+            start = time.perf_counter()
+            for info in islice(pending, CACHED_BATCH_SIZE):
+                library.set_info(*info)
+            library.update_orders()
+            scan_batch_ms.append((time.perf_counter() - start) * 1000)
+            _, seconds = timed(library.filter, query, sort_key, 0)
+            filter_ms.append(seconds * 1000)
+    return {'entries': entries, 'build_s': build_s, 'scores_us_per_file': scores_s / entries * 1e6,
+            'sort_s': sort_s, 'filter_ms': percentiles(filter_ms), 'scan_batch_ms': percentiles(scan_batch_ms)}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(keymap_name, quick=False, spin_budget_ms=2.0):
+    with tempfile.TemporaryDirectory() as workdir:
+        player = make_player(workdir, NullBackend())
+        if not player.set_keymap(keymap_name):
+            raise ValueError(f"Unknown keymap: {keymap_name}")
+        keymap = player.get_current_keymap()
+        results = {
+            'meta': {
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'mido': str(mido.version_info),
+                'keymap': keymap_name,
+                'quick': quick,
+            },
+            'scenarios': {},
+        }
+        for name, generate in SCENARIOS.items():
+            path = os.path.join(workdir, f"{name}.mid")
+            generate(path, **(QUICK_ARGS[name] if quick else {}))
+            print(f"{name}...", file=sys.stderr)
+            results['scenarios'][name] = bench_scenario(path, player, keymap)
+        storage_path = os.path.join(workdir, 'storage.mid')
+        generate_large(storage_path, events=100000 if quick else 1000000)
+        print("plan storage...", file=sys.stderr)
+        results['plan_storage'] = bench_plan_storage(storage_path, keymap)
+        timing_path = os.path.join(workdir, 'timing.mid')
+        generate_timing(timing_path, seconds=2.0 if quick else 5.0)
+        print("realtime lateness...", file=sys.stderr)
+        results['lateness'] = bench_lateness(timing_path, keymap_name, workdir, spin_budget_ms)
+        print("library search...", file=sys.stderr)
+        results['library_search'] = bench_library_search(player.compiled_keymaps, 10000 if quick else 50000)
+        player.flush_settings()
+    return results
+
+
+def print_summary(results):
+    for name, scenario in results['scenarios'].items():
+        print(f"{name:14} {scenario['note_events']:>7} notes  mido {scenario['parse_s'] * 1000:8.1f} ms  "
+              f"stream {scenario['stream_s'] * 1000:7.1f} ms ({scenario['stream_peak_kb']:.0f} KB peak)  "
+              f"compile {scenario['compile_s'] * 1000:8.1f} ms  "
+              f"null {scenario['null_loop_keys_per_sec']:>10.0f} keys/s")
+    for name, scenario in results['scenarios'].items():
+        reduction = scenario['reduction']
+        print(f"{name:14} reduction keeps {reduction['kept']:>6} notes ({reduction['reduced']} reduced, "
+              f"{reduction['dropped']} over budget) vs {reduction['budget_kept']:>6} with the budget alone "
+              f"({reduction['budget_dropped']} dropped)")
+    for name, scenario in results['scenarios'].items():
+        selection = scenario['selection']
+        print(f"{name:14} track selection recompiles in {selection['parts_compile_s'] * 1000:7.1f} ms from "
+              f"{selection['parts_bytes'] / 1024:.0f} KB of decoded parts vs "
+              f"{selection['file_compile_s'] * 1000:7.1f} ms from the file")
+    mapping = results['scenarios']['large']['mapping']
+    for mode, costs in mapping.items():
+        print(f"mode {mode}: search {costs['search_ms']:5.2f} ms, table {costs['table_ns_per_event']:6.1f} ns/event, "
+              f"map_note {costs['map_note_ns_per_event']:8.1f} ns/event")
+    storage = results['plan_storage']
+    print(f"plan: {storage['plan_events']} events, {storage['columns_bytes'] / 2**20:.1f} MB as columns vs "
+          f"{storage['tuples_bytes'] / 2**20:.1f} MB as tuples, "
+          f"iteration {storage['columns_iter_ns_per_event']:.1f} vs {storage['tuples_iter_ns_per_event']:.1f} ns/event")
+    lateness = results['lateness']['lateness_us']
+    if lateness:
+        print(f"lateness: p50 {lateness['p50']:.0f} us, p95 {lateness['p95']:.0f} us, "
+              f"p99 {lateness['p99']:.0f} us, max {lateness['max']:.0f} us")
+    search = results['library_search']
+    print(f"library: {search['entries']} entries indexed in {search['build_s'] * 1000:.0f} ms, "
+          f"filter p50 {search['filter_ms']['p50']:.1f} ms, p95 {search['filter_ms']['p95']:.1f} ms, "
+          f"max {search['filter_ms']['max']:.1f} ms, scan batch p95 {search['scan_batch_ms']['p95']:.1f} ms, "
+          f"keymap scores {search['scores_us_per_file']:.1f} us/file")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--keymap', default='wwm_36_mapping')
+    parser.add_argument('--quick', action='store_true', help="use small files for a fast smoke run")
+    parser.add_argument('--spin-budget-ms', type=float, default=2.0)
+    args = parser.parse_args()
+    results = run(args.keymap, args.quick, args.spin_budget_ms)
+    print_summary(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+from collections import namedtuple
+
+# coverage: share of the distinct pitches a file uses that have a key in the keymap.
+# playable_ratio: share of the file's note events that land on a key without remapping.
+CompatibilityScore = namedtuple('CompatibilityScore', ['coverage', 'playable_ratio'])
+
+
+def note_mask(notes):
+    """128-bit int with bit n set for every MIDI note n."""
+    mask = 0
+    for note in notes:
+        mask |= 1 << note
+    return mask
+
+
+def popcount(value):
+    return bin(value).count('1')
+
+
+class KeymapCompatibility:
+    """Scores a note histogram against every keymap at once.
+
+    Each keymap is reduced to its tuple of notes and a 128-bit note mask.
+    Coverage is a popcount of the file's pitch mask ANDed with the keymap
+    mask, and the playable ratio sums the histogram bins under the keymap's
+    notes, so a file x keymap row costs one pass over the histogram and a
+    C-level sum per keymap, with no file access.
+    """
+
+    def __init__(self, keymaps):
+        self.names = list(keymaps)
+        self.notes = [tuple(keymaps[name].notes) for name in self.names]
+        self.masks = [note_mask(notes) for notes in self.notes]
+
+    def index(self, keymap_name):
+        """Column of keymap_name in score rows, or None."""
+        try:
+            return self.names.index(keymap_name)
+        except ValueError:
+            return None
+
+    def scores(self, histogram):
+        """One CompatibilityScore per keymap for a 128-bin histogram, or None if it holds no notes."""
+        total = sum(histogram)
+        if not total:
+            return None
+        pitches = note_mask(note for note, count in enumerate(histogram) if count)
+        pitch_count = popcount(pitches)
+        return [CompatibilityScore(popcount(pitches & mask) / pitch_count,
+                                   sum(map(histogram.__getitem__, notes)) / total)
+                for notes, mask in zip(self.notes, self.masks)]
+
+    def best(self, row):
+        """Column of the best keymap in a scores() row: most playable notes, then widest coverage."""
+        if not row:
+            return None
+        return max(range(len(row)), key=lambda column: (row[column].playable_ratio, row[column].coverage))
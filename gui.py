@@ -1,22 +1,39 @@
 import sys
 import os
 import webbrowser
+import multiprocessing
 from pathlib import Path
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QPushButton, QComboBox, QListWidget, QListWidgetItem, QLabel,
+    QPushButton, QComboBox, QListWidget, QListWidgetItem, QListView, QLineEdit, QLabel,
     QSpinBox, QDoubleSpinBox, QFileDialog, QMessageBox, QProgressBar,
-    QTabWidget, QGroupBox, QFormLayout, QRadioButton, QButtonGroup
+    QTabWidget, QGroupBox, QFormLayout, QRadioButton, QButtonGroup, QCheckBox, QSlider,
+    QAbstractSlider
 )
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, QThread, QTimer, QAbstractListModel, QModelIndex, pyqtSignal
 from PyQt5.QtGui import QIcon, QFont
 from midiplayer import MidiPlayer
+from libraryscan import LibraryScanner
+from libraryindex import LibraryIndex, SORT_KEYS, SORT_NAME, NOT_SCANNED, is_broad_query
+from midistream import PERCUSSION_CHANNEL
 from languages import translate
 
 
+# GUI refresh rate for playback progress; the player publishes at 20 Hz
+PROGRESS_POLL_MS = 50
+# Seek slider resolution: one step per millisecond of file time
+SEEK_STEPS_PER_SECOND = 1000
+# Queries too short for the trigram index walk the whole library, so they wait for a pause in typing
+BROAD_SEARCH_DELAY_MS = 200
+
+
+def format_time(seconds):
+    return f"{int(seconds // 60):02d}:{int(seconds % 60):02d}"
+
+
 class PlaybackThread(QThread):
+    """Runs play_midi; progress is polled from player.progress instead of signalled."""
     status_changed = pyqtSignal(str)
-    progress_updated = pyqtSignal(int)
     playback_finished = pyqtSignal(bool)
     
     def __init__(self, player, filename):
@@ -25,11 +42,8 @@ class PlaybackThread(QThread):
         self.filename = filename
     
     def run(self):
-        result = self.player.play_midi(self.filename, self.on_progress, self.on_status)
-        self.playback_finished.emit(result)
-    
-    def on_progress(self, msg_index):
-        self.progress_updated.emit(msg_index)
+        result = self.player.play_midi(self.filename, on_status=self.on_status)
+        self.playback_finished.emit(bool(result))
     
     def on_status(self, status):
         self.status_changed.emit(status)
@@ -55,15 +69,109 @@ class TestThread(QThread):
         self.status_changed.emit(status)
 
 
+class ScanThread(QThread):
+    files_scanned = pyqtSignal(list)
+    progress_updated = pyqtSignal(int, int)
+    scan_finished = pyqtSignal(bool)
+    
+    def __init__(self, player, midi_paths):
+        super().__init__()
+        self.player = player
+        self.midi_paths = midi_paths
+        self.scanner = LibraryScanner(player.metadata_cache)
+    
+    def run(self):
+        self.filenames = {filepath: filename for filename, filepath in self.midi_paths}
+        result = self.scanner.scan(list(self.filenames), self.on_results, self.on_progress)
+        self.player.save_metadata_cache()
+        self.scan_finished.emit(result)
+    
+    def cancel(self):
+        self.scanner.cancel()
+    
+    def on_results(self, results):
+        infos = []
+        for filepath, entry in results:
+            filename = self.filenames[filepath]
+            info = self.player.midi_info_from_entry(filename, entry, self.player.get_part_selection(filename))
+            infos.append(self.player.score_midi_info(info))
+        self.files_scanned.emit(infos)
+    
+    def on_progress(self, done, total):
+        self.progress_updated.emit(done, total)
+
+
+class MidiLibraryModel(QAbstractListModel):
+    """List model over a LibraryIndex; the view only asks for the rows it paints."""
+    
+    def __init__(self, library, keymap_names, parent=None):
+        super().__init__(parent)
+        self.library = library
+        self.keymap_names = keymap_names
+        self.rows = []
+        self.query = ''
+        self.sort_key = SORT_NAME
+        self.keymap_column = None
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entry_id = self.rows[index.row()]
+        filename = self.library.names[entry_id]
+        if role == Qt.DisplayRole:
+            if self.library.failed(entry_id):
+                return f"{filename} (error)"
+            duration = self.library.duration(entry_id)
+            return filename if duration is None else f"{filename} ({format_time(duration)})"
+        if role == Qt.UserRole:
+            return filename
+        if role == Qt.ToolTipRole:
+            best_column = self.library.best_column(entry_id)
+            if best_column is not None:
+                best = self.library.score(entry_id, best_column)
+                return f"Best keymap: {self.keymap_names[best_column]} ({best.playable_ratio:.0%} playable)"
+        return None
+    
+    def refresh(self):
+        """Re-run the filter and sort; the view is reset, so callers restore the selection."""
+        self.beginResetModel()
+        self.rows = self.library.filter(self.query, self.sort_key, self.keymap_column)
+        self.endResetModel()
+    
+    def entries_updated(self):
+        """Repaint after entry info changed; visible rows are re-read, nothing is re-sorted."""
+        if self.rows:
+            self.dataChanged.emit(self.index(0), self.index(len(self.rows) - 1))
+    
+    def row_of(self, filename):
+        entry_id = self.library.ids.get(filename)
+        if entry_id is None:
+            return -1
+        try:
+            return self.rows.index(entry_id)
+        except ValueError:
+            return -1
+
+
 class MidiPlayerGUI(QMainWindow):
+    library_changed = pyqtSignal(list)
+    
     def __init__(self, lang='en'):
         super().__init__()
         self.lang = lang
         self.player = None
         self.playback_thread = None
         self.test_thread = None
+        self.scan_thread = None
+        self.library = None
+        self.pending_scan = {}
         self.init_player()
         self.init_ui()
+        self.library_changed.connect(self.on_library_changed)
+        self.player.start_library_watch(self.library_changed.emit)
     
     def init_player(self):
         try:
@@ -71,6 +179,9 @@ class MidiPlayerGUI(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, translate('msg_error', self.lang), f"{translate('msg_init_failed', self.lang)}: {e}")
             sys.exit(1)
+        if self.player.keymap_errors:
+            details = "\n".join(f"{name}: {error}" for name, errors in self.player.keymap_errors.items() for error in errors)
+            QMessageBox.warning(self, translate('msg_warning', self.lang), f"{translate('msg_keymap_errors', self.lang)}\n\n{details}")
     
     def init_ui(self):
         self.setWindowTitle(translate('app_title', self.lang))
@@ -121,16 +232,59 @@ class MidiPlayerGUI(QMainWindow):
         list_font.setPointSize(11)
         list_label.setFont(list_font)
         layout.addWidget(list_label)
-        self.midi_list = QListWidget()
+        search_layout = QHBoxLayout()
+        self.search_edit = QLineEdit()
+        self.search_edit.setFont(QFont(None, 10))
+        self.search_edit.setPlaceholderText(translate('label_search', self.lang))
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.textChanged.connect(self.on_search_changed)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(BROAD_SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(self.refresh_midi_model)
+        search_layout.addWidget(self.search_edit, stretch=1)
+        search_layout.addWidget(QLabel(translate('label_sort', self.lang)))
+        self.sort_combo = QComboBox()
+        self.sort_combo.setFont(QFont(None, 10))
+        for sort_key in SORT_KEYS:
+            self.sort_combo.addItem(translate(f'sort_{sort_key}', self.lang), sort_key)
+        sort_key = self.player.settings.get('library_sort', SORT_NAME)
+        self.sort_combo.setCurrentIndex(SORT_KEYS.index(sort_key) if sort_key in SORT_KEYS else 0)
+        self.sort_combo.currentIndexChanged.connect(self.on_sort_changed)
+        search_layout.addWidget(self.sort_combo)
+        layout.addLayout(search_layout)
+        compatibility = self.player.keymap_compatibility
+        self.library = LibraryIndex(len(compatibility.names))
+        self.midi_model = MidiLibraryModel(self.library, compatibility.names, self)
+        self.midi_model.sort_key = self.sort_combo.currentData()
+        self.midi_model.keymap_column = compatibility.index(self.player.get_keymap_name())
+        self.midi_list = QListView()
         self.midi_list.setFont(QFont(None, 10))
-        self.refresh_midi_list()
-        self.midi_list.itemSelectionChanged.connect(self.on_midi_selected)
+        # Uniform rows let the view lay out 50k entries without measuring each one
+        self.midi_list.setUniformItemSizes(True)
+        self.midi_list.setModel(self.midi_model)
+        self.midi_list.selectionModel().currentChanged.connect(self.on_midi_selected)
         layout.addWidget(self.midi_list, stretch=1)
+        self.scan_label = QLabel()
+        self.scan_label.setFont(QFont(None, 9))
+        self.scan_label.setVisible(False)
+        layout.addWidget(self.scan_label)
         self.info_label = QLabel(translate('label_select_file', self.lang))
         info_font = QFont()
         info_font.setPointSize(10)
         self.info_label.setFont(info_font)
         layout.addWidget(self.info_label)
+        self.parts_label = QLabel(translate('label_parts', self.lang))
+        self.parts_label.setFont(QFont(None, 10))
+        self.parts_label.setVisible(False)
+        layout.addWidget(self.parts_label)
+        self.parts_list = QListWidget()
+        self.parts_list.setFont(QFont(None, 9))
+        self.parts_list.setMaximumHeight(110)
+        self.parts_list.setVisible(False)
+        self.parts_list.itemChanged.connect(self.on_part_toggled)
+        layout.addWidget(self.parts_list)
+        self.refresh_midi_list()
         button_layout = QHBoxLayout()
         self.play_btn = QPushButton(translate('btn_play', self.lang))
         self.play_btn.setFont(QFont(None, 11))
@@ -143,6 +297,12 @@ class MidiPlayerGUI(QMainWindow):
         self.stop_btn.clicked.connect(self.on_stop)
         self.stop_btn.setEnabled(False)
         button_layout.addWidget(self.stop_btn)
+        self.pause_btn = QPushButton(translate('btn_pause', self.lang))
+        self.pause_btn.setFont(QFont(None, 11))
+        self.pause_btn.setMinimumHeight(40)
+        self.pause_btn.clicked.connect(self.on_pause)
+        self.pause_btn.setEnabled(False)
+        button_layout.addWidget(self.pause_btn)
         test_btn = QPushButton(translate('btn_test_keymap', self.lang))
         test_btn.setFont(QFont(None, 11))
         test_btn.setMinimumHeight(40)
@@ -159,6 +319,21 @@ class MidiPlayerGUI(QMainWindow):
         self.progress_bar.setMaximumHeight(12)
         self.progress_bar.setVisible(False)
         layout.addWidget(self.progress_bar)
+        self.seek_slider = QSlider(Qt.Horizontal)
+        self.seek_slider.setRange(0, 0)
+        self.seek_slider.setSingleStep(SEEK_STEPS_PER_SECOND)
+        self.seek_slider.setPageStep(10 * SEEK_STEPS_PER_SECOND)
+        self.seek_slider.setVisible(False)
+        self.seek_slider.sliderReleased.connect(self.on_seek)
+        self.seek_slider.actionTriggered.connect(self.on_seek_action)
+        layout.addWidget(self.seek_slider)
+        self.playback_info_label = QLabel()
+        self.playback_info_label.setFont(QFont(None, 9))
+        self.playback_info_label.setVisible(False)
+        layout.addWidget(self.playback_info_label)
+        self.progress_timer = QTimer(self)
+        self.progress_timer.setInterval(PROGRESS_POLL_MS)
+        self.progress_timer.timeout.connect(self.on_progress_timer)
         return widget
     
     def create_settings_tab(self):
@@ -233,7 +408,8 @@ class MidiPlayerGUI(QMainWindow):
             translate('mode_discard', self.lang),
             translate('mode_align_low', self.lang),
             translate('mode_align_high', self.lang),
-            translate('mode_optimal', self.lang)
+            translate('mode_optimal', self.lang),
+            translate('mode_transpose', self.lang)
         ])
         self.range_combo.setCurrentIndex(self.player.get_range_mismatch_handling() - 1)
         self.range_combo.currentIndexChanged.connect(self.on_range_changed)
@@ -269,6 +445,36 @@ class MidiPlayerGUI(QMainWindow):
         self.countdown_spin.setValue(self.player.settings.get('countdown_duration', 3))
         self.countdown_spin.valueChanged.connect(self.on_countdown_changed)
         misc_layout.addRow(translate('label_countdown', self.lang), self.countdown_spin)
+        self.hold_spin = QSpinBox()
+        self.hold_spin.setFont(QFont(None, 11))
+        self.hold_spin.setMinimum(1)
+        self.hold_spin.setMaximum(1000)
+        self.hold_spin.valueChanged.connect(self.on_hold_changed)
+        misc_layout.addRow(translate('label_key_hold', self.lang), self.hold_spin)
+        self.hold_note_off_check = QCheckBox()
+        self.hold_note_off_check.toggled.connect(self.on_hold_note_off_changed)
+        misc_layout.addRow(translate('label_hold_note_off', self.lang), self.hold_note_off_check)
+        self.fold_octaves_check = QCheckBox()
+        self.fold_octaves_check.toggled.connect(self.on_fold_octaves_changed)
+        misc_layout.addRow(translate('label_fold_octaves', self.lang), self.fold_octaves_check)
+        self.max_polyphony_spin = QSpinBox()
+        self.max_polyphony_spin.setFont(QFont(None, 11))
+        self.max_polyphony_spin.setMinimum(0)
+        self.max_polyphony_spin.setMaximum(10)
+        self.max_polyphony_spin.setSpecialValueText(translate('value_unlimited', self.lang))
+        self.max_polyphony_spin.valueChanged.connect(self.on_max_polyphony_changed)
+        misc_layout.addRow(translate('label_max_polyphony', self.lang), self.max_polyphony_spin)
+        self.max_keys_spin = QSpinBox()
+        self.max_keys_spin.setFont(QFont(None, 11))
+        self.max_keys_spin.setMinimum(0)
+        self.max_keys_spin.setMaximum(100)
+        self.max_keys_spin.setSpecialValueText(translate('value_unlimited', self.lang))
+        self.max_keys_spin.valueChanged.connect(self.on_max_keys_changed)
+        misc_layout.addRow(translate('label_max_keys_per_sec', self.lang), self.max_keys_spin)
+        self.reduce_density_check = QCheckBox()
+        self.reduce_density_check.toggled.connect(self.on_reduce_density_changed)
+        misc_layout.addRow(translate('label_reduce_density', self.lang), self.reduce_density_check)
+        self.load_keymap_options()
         misc_group.setLayout(misc_layout)
         layout.addWidget(misc_group)
         dir_group = QGroupBox(translate('group_directory', self.lang))
@@ -429,18 +635,106 @@ class MidiPlayerGUI(QMainWindow):
         """
     
     def refresh_midi_list(self):
-        self.midi_list.clear()
-        files = self.player.list_midi_files()
-        for filename in files:
-            info = self.player.get_midi_info(filename)
-            if 'error' not in info:
-                duration = f"{int(info['duration'] // 60):02d}:{int(info['duration'] % 60):02d}"
-                display_text = f"{filename} ({duration})"
-            else:
-                display_text = f"{filename} (error)"
-            item = QListWidgetItem(display_text)
-            item.setData(Qt.UserRole, filename)
-            self.midi_list.addItem(item)
+        self.cancel_scan()
+        self.library.clear()
+        midi_paths = self.player.list_midi_paths()
+        for filename, _ in midi_paths:
+            self.library.add(filename)
+        self.refresh_midi_model()
+        self.pending_scan = {}
+        self.start_scan(midi_paths)
+    
+    def refresh_midi_model(self):
+        """Re-filter and re-sort the list, keeping the selected file selected while it is shown."""
+        filename = self.selected_midi_filename()
+        self.midi_model.refresh()
+        row = self.midi_model.row_of(filename) if filename else -1
+        if row >= 0:
+            self.midi_list.setCurrentIndex(self.midi_model.index(row))
+        elif filename:
+            self.on_midi_selected()
+    
+    def selected_midi_filename(self):
+        index = self.midi_list.currentIndex()
+        return index.data(Qt.UserRole) if index.isValid() else None
+    
+    def start_scan(self, midi_paths):
+        self.scan_thread = ScanThread(self.player, midi_paths)
+        self.scan_thread.files_scanned.connect(self.on_files_scanned)
+        self.scan_thread.progress_updated.connect(self.on_scan_progress)
+        self.scan_thread.scan_finished.connect(self.on_scan_finished)
+        self.scan_thread.start()
+    
+    def cancel_scan(self):
+        if self.scan_thread and self.scan_thread.isRunning():
+            self.scan_thread.cancel()
+            self.scan_thread.wait()
+    
+    def on_files_scanned(self, infos):
+        current = self.selected_midi_filename()
+        for info in infos:
+            self.store_midi_info(info)
+        # Re-place the batch in the cached sort orders now rather than on the next keystroke
+        self.library.update_orders()
+        self.midi_model.entries_updated()
+        if any(info['filename'] == current for info in infos):
+            self.update_info_label()
+    
+    def on_scan_progress(self, done, total):
+        self.scan_label.setVisible(done < total)
+        self.scan_label.setText(f"{translate('status_scanning', self.lang)} {done}/{total}")
+    
+    def on_scan_finished(self, completed):
+        self.scan_label.setVisible(False)
+        if self.midi_model.sort_key != SORT_NAME:
+            self.refresh_midi_model()
+        self.start_pending_scan()
+    
+    def store_midi_info(self, info):
+        """Record a score_midi_info() dict in the library index."""
+        best_keymap = info.get('best_keymap')
+        best_column = self.player.keymap_compatibility.index(best_keymap) if best_keymap else None
+        self.library.set_info(info, info.get('keymap_scores'), best_column)
+    
+    def start_pending_scan(self):
+        """Scan files queued by the library watcher unless a scan is already running."""
+        if self.pending_scan and not (self.scan_thread and self.scan_thread.isRunning()):
+            midi_paths = sorted(self.pending_scan.items())
+            self.pending_scan = {}
+            self.start_scan(midi_paths)
+    
+    def on_library_changed(self, changes):
+        """Apply watcher deltas to the library index and scan only the files that changed."""
+        names_changed = False
+        for filename in {os.path.basename(filepath) for _, filepath in changes}:
+            # The first directory still wins: a removed file may be shadowed by, or fall back to, another copy
+            filepath = self.player.find_midi_path(filename)
+            if filepath is None:
+                names_changed |= self.library.remove(filename)
+                self.pending_scan.pop(filename, None)
+                continue
+            if filename not in self.library:
+                self.library.add(filename)
+                names_changed = True
+            self.pending_scan[filename] = filepath
+        if names_changed:
+            self.refresh_midi_model()
+        self.start_pending_scan()
+    
+    def on_search_changed(self, text):
+        self.midi_model.query = text
+        if is_broad_query(text):
+            self.search_timer.start()
+        else:
+            self.search_timer.stop()
+            self.refresh_midi_model()
+    
+    def on_sort_changed(self, index):
+        sort_key = self.sort_combo.itemData(index)
+        self.player.settings['library_sort'] = sort_key
+        self.player.save_settings()
+        self.midi_model.sort_key = sort_key
+        self.refresh_midi_model()
     
     def refresh_dir_list(self):
         self.dir_list.clear()
@@ -451,59 +745,139 @@ class MidiPlayerGUI(QMainWindow):
     def on_keymap_changed(self, keymap_name):
         if keymap_name:
             self.player.set_keymap(keymap_name)
-            self.refresh_midi_list()
+            self.load_keymap_options()
+            # Every file's score for every keymap is already in the library index
+            self.midi_model.keymap_column = self.player.keymap_compatibility.index(keymap_name)
+            if self.midi_model.sort_key != SORT_NAME:
+                self.refresh_midi_model()
             self.update_info_label()
     
     def on_midi_selected(self):
         self.update_info_label()
+        self.update_parts_list()
     
     def on_dir_selected(self):
         pass
     
     def update_info_label(self):
-        if not self.midi_list.currentItem():
+        filename = self.selected_midi_filename()
+        if not filename:
             self.info_label.setText("Select a MIDI file")
             return
-        filename = self.midi_list.currentItem().data(Qt.UserRole)
-        info = self.player.get_midi_info(filename)
-        if 'error' in info:
-            self.info_label.setText(f"Error: {info['error']}")
+        entry_id = self.library.ids[filename]
+        if self.library.low_notes[entry_id] == NOT_SCANNED:
+            # Selected before the scan reached it
+            self.store_midi_info(self.player.score_midi_info(self.player.get_midi_info(filename)))
+        if self.library.failed(entry_id):
+            self.info_label.setText(f"Error: {self.player.get_midi_info(filename).get('error')}")
             return
-        duration = f"{int(info['duration'] // 60):02d}:{int(info['duration'] % 60):02d}"
-        range_check = self.player.check_midi_range(filename)
-        if range_check == 'compatible':
-            status = "✓ Compatible"
-            color = "green"
-        elif range_check == 'no_notes':
+        duration = format_time(self.library.duration(entry_id))
+        score = self.library.score(entry_id, self.midi_model.keymap_column)
+        best_column = self.library.best_column(entry_id)
+        if best_column is None:
             status = "No notes"
             color = "gray"
+        elif score is None:
+            status = "No keymap"
+            color = "gray"
+        elif score.playable_ratio == 1:
+            status = "✓ Compatible"
+            color = "green"
         else:
-            status = "⚠ Range mismatch"
+            status = f"⚠ {score.playable_ratio:.0%} of notes on keys"
             color = "orange"
         info_text = f"<b>{filename}</b><br>Duration: {duration}<br><span style='color:{color};'>{status}</span>"
+        if score is not None:
+            best_name = self.player.keymap_compatibility.names[best_column]
+            info_text += (f"<br>Coverage: {score.coverage:.0%}, playable notes: {score.playable_ratio:.0%}"
+                          f"<br>Best keymap: {best_name}")
         self.info_label.setText(info_text)
     
+    def update_parts_list(self):
+        """List the selected file's tracks and channels with their note stats, checked when they play."""
+        filename = self.selected_midi_filename()
+        stats = self.player.get_part_stats(filename) if filename else None
+        self.parts_list.blockSignals(True)
+        self.parts_list.clear()
+        for kind, label in (('track', 'part_track'), ('channel', 'part_channel')):
+            for part in stats[kind + 's'] if stats else ():
+                index = part[kind]
+                text = f"{translate(label, self.lang)} {index + 1}"
+                if part.get('name'):
+                    text += f" ({part['name']})"
+                elif kind == 'channel' and index == PERCUSSION_CHANNEL:
+                    text += f" ({translate('part_percussion', self.lang)})"
+                low, high = part['note_range']
+                text += f": {part['note_count']} notes, {low}-{high}, {part['density']:.1f}/s"
+                item = QListWidgetItem(text)
+                item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+                item.setCheckState(Qt.Checked if part['included'] else Qt.Unchecked)
+                item.setData(Qt.UserRole, (kind, index))
+                self.parts_list.addItem(item)
+        self.parts_list.blockSignals(False)
+        self.parts_label.setVisible(bool(stats))
+        self.parts_list.setVisible(bool(stats))
+    
+    def on_part_toggled(self, item):
+        filename = self.selected_midi_filename()
+        if not filename:
+            return
+        kind, index = item.data(Qt.UserRole)
+        included = item.checkState() == Qt.Checked
+        if kind == 'track':
+            self.player.set_track_included(filename, index, included)
+        else:
+            self.player.set_channel_included(filename, index, included)
+        # Range and keymap scores only count the parts that play
+        self.store_midi_info(self.player.score_midi_info(self.player.get_midi_info(filename)))
+        self.midi_model.entries_updated()
+        self.update_info_label()
+    
     def on_play(self):
-        if not self.midi_list.currentItem():
+        filename = self.selected_midi_filename()
+        if not filename:
             QMessageBox.warning(self, translate('msg_warning', self.lang), translate('msg_select_file', self.lang))
             return
         if not self.player.get_current_keymap():
             QMessageBox.warning(self, translate('msg_warning', self.lang), translate('msg_select_keymap', self.lang))
             return
-        filename = self.midi_list.currentItem().data(Qt.UserRole)
         self.play_btn.setEnabled(False)
         self.stop_btn.setEnabled(True)
-        self.progress_bar.setVisible(True)
-        self.progress_bar.setValue(0)
+        self.pause_btn.setEnabled(True)
+        self.pause_btn.setText(translate('btn_pause', self.lang))
+        self.seek_slider.setVisible(True)
+        # The range is set from the plan length once the playback thread has compiled it
+        self.seek_slider.setRange(0, 0)
+        self.playback_info_label.setText("")
+        self.playback_info_label.setVisible(True)
         self.playback_thread = PlaybackThread(self.player, filename)
         self.playback_thread.status_changed.connect(self.on_status_changed)
-        self.playback_thread.progress_updated.connect(self.on_playback_progress)
         self.playback_thread.playback_finished.connect(self.on_playback_finished)
         self.playback_thread.start()
+        self.progress_timer.start()
     
     def on_stop(self):
         self.player.stop_playback = True
         self.stop_btn.setEnabled(False)
+        self.pause_btn.setEnabled(False)
+    
+    def on_pause(self):
+        if self.player.is_paused:
+            self.player.resume_playback()
+            self.pause_btn.setText(translate('btn_pause', self.lang))
+        else:
+            self.player.pause_playback()
+            self.pause_btn.setText(translate('btn_resume', self.lang))
+    
+    def on_seek(self):
+        # sliderPosition is already moved when actionTriggered fires, value is not
+        self.player.seek_playback(self.seek_slider.sliderPosition() / SEEK_STEPS_PER_SECOND)
+    
+    def on_seek_action(self, action):
+        """Groove clicks, keys and the wheel seek at once; a drag seeks when it is released."""
+        if action == QAbstractSlider.SliderMove and self.seek_slider.isSliderDown():
+            return
+        self.on_seek()
     
     def on_test_keymap(self):
         if not self.player.get_current_keymap():
@@ -522,7 +896,6 @@ class MidiPlayerGUI(QMainWindow):
         if folder:
             if self.player.add_midi_directory(folder):
                 self.refresh_dir_list()
-                self.refresh_midi_list()
                 self.status_label.setText(f"Added: {folder}")
             else:
                 QMessageBox.warning(self, translate('msg_error', self.lang), translate('msg_error_invalid_dir', self.lang))
@@ -533,7 +906,6 @@ class MidiPlayerGUI(QMainWindow):
         directory = self.dir_list.currentItem().text()
         if self.player.remove_midi_directory(directory):
             self.refresh_dir_list()
-            self.refresh_midi_list()
             self.status_label.setText(f"Removed: {directory}")
     
     def on_browse_folder(self):
@@ -576,18 +948,84 @@ class MidiPlayerGUI(QMainWindow):
         self.player.settings['countdown_duration'] = value
         self.player.save_settings()
     
+    def load_keymap_options(self):
+        options = self.player.get_keymap_options()
+        self.hold_spin.blockSignals(True)
+        self.hold_note_off_check.blockSignals(True)
+        self.fold_octaves_check.blockSignals(True)
+        self.max_polyphony_spin.blockSignals(True)
+        self.max_keys_spin.blockSignals(True)
+        self.reduce_density_check.blockSignals(True)
+        self.hold_spin.setValue(options['hold_ms'])
+        self.hold_note_off_check.setChecked(options['hold_until_note_off'])
+        self.fold_octaves_check.setChecked(options['fold_octaves'])
+        self.max_polyphony_spin.setValue(options['max_polyphony'])
+        self.max_keys_spin.setValue(options['max_keys_per_sec'])
+        self.reduce_density_check.setChecked(options['reduce_density'])
+        self.update_reduce_density_enabled()
+        self.hold_spin.blockSignals(False)
+        self.hold_note_off_check.blockSignals(False)
+        self.fold_octaves_check.blockSignals(False)
+        self.max_polyphony_spin.blockSignals(False)
+        self.max_keys_spin.blockSignals(False)
+        self.reduce_density_check.blockSignals(False)
+    
+    def on_hold_changed(self, value):
+        self.player.set_keymap_options(self.player.get_keymap_name(), hold_ms=value)
+    
+    def on_hold_note_off_changed(self, checked):
+        self.player.set_keymap_options(self.player.get_keymap_name(), hold_until_note_off=checked)
+    
+    def on_fold_octaves_changed(self, checked):
+        self.player.set_keymap_options(self.player.get_keymap_name(), fold_octaves=checked)
+    
+    def on_max_polyphony_changed(self, value):
+        self.player.set_keymap_options(self.player.get_keymap_name(), max_polyphony=value)
+    
+    def on_max_keys_changed(self, value):
+        self.player.set_keymap_options(self.player.get_keymap_name(), max_keys_per_sec=value)
+        self.update_reduce_density_enabled()
+    
+    def on_reduce_density_changed(self, checked):
+        self.player.set_keymap_options(self.player.get_keymap_name(), reduce_density=checked)
+    
+    def update_reduce_density_enabled(self):
+        # Thinning only fits chords to the key budget, so it does nothing while the budget is unlimited
+        enabled = self.max_keys_spin.value() > 0
+        self.reduce_density_check.setEnabled(enabled)
+        self.reduce_density_check.setToolTip('' if enabled else translate('tip_reduce_density', self.lang))
+    
     def on_status_changed(self, status):
         self.status_label.setText(status)
     
-    def on_playback_progress(self, msg_index):
-        """Update progress bar during playback (0-100)."""
-        self.progress_bar.setMaximum(100)
-        self.progress_bar.setValue(msg_index)
+    def on_progress_timer(self):
+        """Poll the player's published progress; the slider is left alone while dragged."""
+        snapshot = self.player.progress.snapshot
+        if not snapshot.playing:
+            return
+        length = int(snapshot.length * SEEK_STEPS_PER_SECOND)
+        if self.seek_slider.maximum() != length:
+            self.seek_slider.setRange(0, length)
+        if not self.seek_slider.isSliderDown():
+            self.seek_slider.setValue(int(snapshot.position * SEEK_STEPS_PER_SECOND))
+        self.playback_info_label.setText(
+            f"{format_time(snapshot.elapsed)} / -{format_time(snapshot.remaining)}  |  "
+            f"{translate('label_notes_sent', self.lang)} {snapshot.notes_sent}  |  "
+            f"{translate('label_notes_dropped', self.lang)} {snapshot.notes_dropped}  |  "
+            f"{translate('label_lateness', self.lang)} {snapshot.lateness_ms:.2f} ms"
+        )
     
     def on_playback_finished(self, completed):
         self.play_btn.setEnabled(True)
         self.stop_btn.setEnabled(False)
-        self.progress_bar.setVisible(False)
+        self.pause_btn.setEnabled(False)
+        self.pause_btn.setText(translate('btn_pause', self.lang))
+        self.seek_slider.setVisible(False)
+        self.progress_timer.stop()
+        self.playback_info_label.setVisible(False)
+        report = self.player.last_report
+        if report is not None and report.batches:
+            self.status_label.setText(f"{self.status_label.text()} - {report.summary()}")
     
     def on_test_progress(self, current, total):
         self.progress_bar.setMaximum(100)
@@ -597,9 +1035,19 @@ class MidiPlayerGUI(QMainWindow):
         self.progress_bar.setVisible(False)
         if completed:
             QMessageBox.information(self, translate('msg_success', self.lang), translate('msg_test_complete', self.lang))
+    
+    def closeEvent(self, event):
+        self.cancel_scan()
+        if self.player:
+            self.player.stop_library_watch()
+            self.player.flush_settings()
+            # Files analysed on the GUI thread since the last scan are only in memory
+            self.player.save_metadata_cache()
+        super().closeEvent(event)
 
 
 def main():
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     lang = 'en'
     if os.path.exists('settings.json'):
@@ -613,6 +1061,7 @@ def main():
     else:
         player = MidiPlayer()
         player.save_settings()
+        player.flush_settings()
     gui = MidiPlayerGUI(lang=lang)
     gui.show()
     sys.exit(app.exec_())
@@ -0,0 +1,116 @@
+from collections.abc import Mapping
+
+SCANCODE_MAP = {
+    'a': 0x1E, 'b': 0x30, 'c': 0x2E, 'd': 0x20, 'e': 0x12, 'f': 0x21,
+    'g': 0x22, 'h': 0x23, 'i': 0x17, 'j': 0x24, 'k': 0x25, 'l': 0x26,
+    'm': 0x32, 'n': 0x31, 'o': 0x18, 'p': 0x19, 'q': 0x10, 'r': 0x13,
+    's': 0x1F, 't': 0x14, 'u': 0x16, 'v': 0x2F, 'w': 0x11, 'x': 0x2D,
+    'y': 0x15, 'z': 0x2C,
+    '0': 0x0B, '1': 0x02, '2': 0x03, '3': 0x04, '4': 0x05, '5': 0x06,
+    '6': 0x07, '7': 0x08, '8': 0x09, '9': 0x0A,
+    'space': 0x39, 'enter': 0x1C, 'tab': 0x0F, 'backspace': 0x0E,
+    'escape': 0x01, 'delete': 0xE053, 'insert': 0xE052,
+    'up': 0xE048, 'down': 0xE050, 'left': 0xE04B, 'right': 0xE04D,
+    'home': 0xE047, 'end': 0xE04F, 'pageup': 0xE049, 'pagedown': 0xE051,
+    'f1': 0x3B, 'f2': 0x3C, 'f3': 0x3D, 'f4': 0x3E, 'f5': 0x3F,
+    'f6': 0x40, 'f7': 0x41, 'f8': 0x42, 'f9': 0x43, 'f10': 0x44,
+    'f11': 0x57, 'f12': 0x58,
+}
+
+MODIFIER_SCANCODES = {
+    'shift': 0x2A,
+    'ctrl': 0x1D,
+    'alt': 0x38
+}
+
+KEYEVENTF_KEYUP = 0x0002
+KEYEVENTF_SCANCODE = 0x0008
+KEYEVENTF_EXTENDEDKEY = 0x0001
+
+# Playback plan flags. The low bits match the keybd_event flags so a plan
+# entry can be handed to the output layer without translation.
+PLAN_EXTENDED = KEYEVENTF_EXTENDEDKEY
+PLAN_KEYUP = KEYEVENTF_KEYUP
+PLAN_SHIFT = 0x0010
+PLAN_CTRL = 0x0020
+PLAN_ALT = 0x0040
+
+MODIFIER_FLAGS = (
+    (PLAN_SHIFT, MODIFIER_SCANCODES['shift']),
+    (PLAN_CTRL, MODIFIER_SCANCODES['ctrl']),
+    (PLAN_ALT, MODIFIER_SCANCODES['alt']),
+)
+
+
+def parse_key(key_string):
+    """Turn a keymap string like 'shift+z' into (scancode, flags), or None if invalid."""
+    parts = key_string.lower().split('+')
+    flags = 0
+    main_key = None
+    for part in parts:
+        part = part.strip()
+        if part == 'shift':
+            flags |= PLAN_SHIFT
+        elif part == 'ctrl':
+            flags |= PLAN_CTRL
+        elif part == 'alt':
+            flags |= PLAN_ALT
+        else:
+            main_key = part
+    if not main_key or main_key not in SCANCODE_MAP:
+        return None
+    scancode = SCANCODE_MAP[main_key]
+    if scancode > 0xFF:
+        flags |= PLAN_EXTENDED
+        scancode = scancode & 0xFF
+    return scancode, flags
+
+
+class CompiledKeymap(Mapping):
+    """Read-only note -> key string mapping with every key parsed up front.
+
+    Besides the mapping itself it carries the sorted note numbers, the note
+    range and, per note, the pre-resolved press as (modifier scancodes,
+    scancode, extended flag) plus the (scancode, flags) form used by playback
+    plans. Entries that cannot be parsed are left out and listed in errors.
+    """
+
+    def __init__(self, name, mapping):
+        self.name = name
+        self.errors = []
+        self._keys = {}
+        self.presses = {}
+        self.plan_keys = {}
+        for note, key_string in mapping.items():
+            try:
+                note = int(note)
+            except (TypeError, ValueError):
+                self.errors.append(f"'{note}' is not a MIDI note number")
+                continue
+            if not 0 <= note <= 127:
+                self.errors.append(f"note {note} is outside 0-127")
+                continue
+            parsed = parse_key(key_string) if isinstance(key_string, str) else None
+            if parsed is None:
+                self.errors.append(f"note {note}: invalid key '{key_string}'")
+                continue
+            scancode, flags = parsed
+            modifiers = tuple(mod for flag, mod in MODIFIER_FLAGS if flags & flag)
+            self._keys[note] = key_string
+            self.presses[note] = (modifiers, scancode, flags & PLAN_EXTENDED)
+            self.plan_keys[note] = parsed
+        self.notes = tuple(sorted(self._keys))
+        self.min_note = self.notes[0] if self.notes else None
+        self.max_note = self.notes[-1] if self.notes else None
+
+    def __getitem__(self, note):
+        return self._keys[note]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f"CompiledKeymap({self.name!r}, {len(self)} keys)"
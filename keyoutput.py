@@ -0,0 +1,358 @@
+import os
+import sys
+import time
+import ctypes
+from array import array
+from ctypes import wintypes
+from ctypes.util import find_library
+from itertools import groupby
+from operator import itemgetter
+from keycodes import (
+    SCANCODE_MAP, MODIFIER_SCANCODES, KEYEVENTF_KEYUP, KEYEVENTF_SCANCODE,
+    KEYEVENTF_EXTENDEDKEY, PLAN_EXTENDED, PLAN_KEYUP, MODIFIER_FLAGS
+)
+
+INPUT_KEYBOARD = 1
+KEY_HOLD_SECONDS = 0.01
+ULONG_PTR = ctypes.c_size_t
+
+
+class MOUSEINPUT(ctypes.Structure):
+    _fields_ = [
+        ('dx', wintypes.LONG),
+        ('dy', wintypes.LONG),
+        ('mouseData', wintypes.DWORD),
+        ('dwFlags', wintypes.DWORD),
+        ('time', wintypes.DWORD),
+        ('dwExtraInfo', ULONG_PTR),
+    ]
+
+
+class KEYBDINPUT(ctypes.Structure):
+    _fields_ = [
+        ('wVk', wintypes.WORD),
+        ('wScan', wintypes.WORD),
+        ('dwFlags', wintypes.DWORD),
+        ('time', wintypes.DWORD),
+        ('dwExtraInfo', ULONG_PTR),
+    ]
+
+
+class HARDWAREINPUT(ctypes.Structure):
+    _fields_ = [
+        ('uMsg', wintypes.DWORD),
+        ('wParamL', wintypes.WORD),
+        ('wParamH', wintypes.WORD),
+    ]
+
+
+class _INPUTUNION(ctypes.Union):
+    _fields_ = [('mi', MOUSEINPUT), ('ki', KEYBDINPUT), ('hi', HARDWAREINPUT)]
+
+
+class INPUT(ctypes.Structure):
+    _fields_ = [('type', wintypes.DWORD), ('union', _INPUTUNION)]
+
+
+def _key_input(scancode, flags):
+    return INPUT(INPUT_KEYBOARD, _INPUTUNION(ki=KEYBDINPUT(0, scancode, flags, 0, 0)))
+
+
+def build_batches(events, modifier_states=None):
+    """Group time-ordered plan events sharing a timestamp into (time, sequence) batches.
+
+    A sequence lists raw (scancode, keybd flags) events in send order. Key-ups
+    go first, then key-downs grouped by modifier set, unmodified keys first.
+    Modifiers are switched between groups so every key-down carries exactly
+    the modifiers its keymap entry asked for, and a modifier is released once
+    no held key needs it. If modifier_states is a list, the modifiers held
+    when each batch starts are appended to it, so playback can restore them
+    after jumping to a batch.
+    """
+    batches = []
+    held = {}
+    held_modifiers = []
+    for batch_time, batch_events in groupby(events, key=itemgetter(0)):
+        batch_modifiers = tuple(held_modifiers)
+        ups = []
+        groups = {}
+        for _, scancode, flags in batch_events:
+            if flags & PLAN_KEYUP:
+                ups.append((scancode, flags & PLAN_EXTENDED))
+            else:
+                modifiers = tuple(mod for flag, mod in MODIFIER_FLAGS if flags & flag)
+                groups.setdefault(modifiers, []).append((scancode, flags & PLAN_EXTENDED))
+
+        sequence = []
+        for key in ups:
+            if held.pop(key, None) is not None:
+                sequence.append((key[0], KEYEVENTF_SCANCODE | key[1] | KEYEVENTF_KEYUP))
+        for modifiers, keys in sorted(groups.items(), key=lambda group: len(group[0])):
+            for mod in reversed(held_modifiers):
+                if mod not in modifiers:
+                    sequence.append((mod, KEYEVENTF_SCANCODE | KEYEVENTF_KEYUP))
+            held_modifiers = [mod for mod in held_modifiers if mod in modifiers]
+            for mod in modifiers:
+                if mod not in held_modifiers:
+                    sequence.append((mod, KEYEVENTF_SCANCODE))
+                    held_modifiers.append(mod)
+            for key in keys:
+                if key in held:
+                    sequence.append((key[0], KEYEVENTF_SCANCODE | key[1] | KEYEVENTF_KEYUP))
+                sequence.append((key[0], KEYEVENTF_SCANCODE | key[1]))
+                held[key] = modifiers
+        needed = set()
+        for modifiers in held.values():
+            needed.update(modifiers)
+        for mod in reversed(held_modifiers):
+            if mod not in needed:
+                sequence.append((mod, KEYEVENTF_SCANCODE | KEYEVENTF_KEYUP))
+        held_modifiers = [mod for mod in held_modifiers if mod in needed]
+        if sequence:
+            if modifier_states is not None:
+                modifier_states.append(batch_modifiers)
+            batches.append((batch_time, sequence))
+    return batches
+
+
+def modifier_sequence(modifiers):
+    """Key-down sequence for the given modifier scancodes."""
+    return [(mod, KEYEVENTF_SCANCODE) for mod in modifiers]
+
+
+def chord_sequences(keys):
+    """Return the (down, up) sequences for tapping a chord once."""
+    events = [(0.0, scancode, flags) for scancode, flags in keys]
+    events += [(1.0, scancode, flags | PLAN_KEYUP) for scancode, flags in keys]
+    (_, down), (_, up) = build_batches(events)
+    return down, up
+
+
+def release_sequence(events):
+    """Key-ups for every key and modifier a plan can hold, used when playback stops early."""
+    keys = {(scancode, flags & PLAN_EXTENDED) for _, scancode, flags in events}
+    sequence = [(scancode, KEYEVENTF_SCANCODE | extended | KEYEVENTF_KEYUP) for scancode, extended in sorted(keys)]
+    sequence += [(mod, KEYEVENTF_SCANCODE | KEYEVENTF_KEYUP) for _, mod in MODIFIER_FLAGS]
+    return sequence
+
+
+class OutputBackend:
+    """Base class for key output backends.
+
+    prepare() turns a raw (scancode, keybd flags) sequence into whatever
+    send() consumes, ahead of playback. send() receives the scheduled
+    deadline so backends can record or compare it. Backends that are not
+    realtime are driven as fast as possible, without waiting for deadlines.
+    """
+
+    name = None
+    realtime = True
+
+    def prepare(self, sequence):
+        return tuple(sequence)
+
+    def send(self, prepared, deadline_ns=None):
+        raise NotImplementedError
+
+    def press_chord(self, keys, hold=KEY_HOLD_SECONDS):
+        down, up = chord_sequences(keys)
+        self.send(self.prepare(down))
+        if self.realtime:
+            time.sleep(hold)
+        self.send(self.prepare(up))
+
+    def close(self):
+        pass
+
+
+class SendInputBackend(OutputBackend):
+    """Windows key output through SendInput, one call per batch.
+
+    INPUT arrays are built once per distinct sequence and reused, and the
+    SendInput pointer is resolved with argtypes when the backend is created.
+    """
+
+    name = 'sendinput'
+
+    def __init__(self):
+        user32 = ctypes.WinDLL('user32', use_last_error=True)
+        self._send_input = user32.SendInput
+        self._send_input.argtypes = (wintypes.UINT, ctypes.POINTER(INPUT), ctypes.c_int)
+        self._send_input.restype = wintypes.UINT
+        self._input_size = ctypes.sizeof(INPUT)
+        self._prepared = {}
+
+    def prepare(self, sequence):
+        """Return the cached INPUT array for a sequence of (scancode, keybd flags)."""
+        sequence = tuple(sequence)
+        prepared = self._prepared.get(sequence)
+        if prepared is None:
+            inputs = [_key_input(scancode, flags) for scancode, flags in sequence]
+            prepared = (len(inputs), (INPUT * len(inputs))(*inputs))
+            self._prepared[sequence] = prepared
+        return prepared
+
+    def send(self, prepared, deadline_ns=None):
+        count, inputs = prepared
+        if count:
+            self._send_input(count, inputs, self._input_size)
+
+
+class NullBackend(OutputBackend):
+    """Discards all key events, only counting them."""
+
+    name = 'null'
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.sent_events = 0
+
+    def send(self, prepared, deadline_ns=None):
+        self.sent_events += len(prepared)
+
+
+class RecordingBackend(OutputBackend):
+    """Captures every raw key event with its scheduled and actual send time.
+
+    Rows are kept in parallel typed arrays; see events() for the tuple view.
+    """
+
+    name = 'recording'
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.clear()
+
+    def clear(self):
+        self.deadlines_ns = array('q')
+        self.sent_ns = array('q')
+        self.scancodes = array('H')
+        self.flags = array('H')
+
+    def send(self, prepared, deadline_ns=None):
+        now = time.perf_counter_ns()
+        if deadline_ns is None:
+            deadline_ns = now
+        for scancode, flags in prepared:
+            self.deadlines_ns.append(deadline_ns)
+            self.sent_ns.append(now)
+            self.scancodes.append(scancode)
+            self.flags.append(flags)
+
+    def __len__(self):
+        return len(self.scancodes)
+
+    def events(self):
+        """Return recorded (deadline_ns, sent_ns, scancode, flags) tuples."""
+        return list(zip(self.deadlines_ns, self.sent_ns, self.scancodes, self.flags))
+
+
+# X keysym names for keymap keys whose name differs from the keysym
+XKEYSYM_NAMES = {
+    'enter': 'Return', 'tab': 'Tab', 'backspace': 'BackSpace', 'escape': 'Escape',
+    'delete': 'Delete', 'insert': 'Insert', 'up': 'Up', 'down': 'Down',
+    'left': 'Left', 'right': 'Right', 'home': 'Home', 'end': 'End',
+    'pageup': 'Prior', 'pagedown': 'Next',
+    'shift': 'Shift_L', 'ctrl': 'Control_L', 'alt': 'Alt_L',
+}
+
+
+def keysym_name(key_name):
+    if key_name in XKEYSYM_NAMES:
+        return XKEYSYM_NAMES[key_name]
+    if key_name.startswith('f') and key_name[1:].isdigit():
+        return key_name.upper()
+    return key_name
+
+
+def load_xlib():
+    """Load libX11 and libXtst with argtypes set, or raise OSError."""
+    x11_path = find_library('X11')
+    xtst_path = find_library('Xtst')
+    if not x11_path or not xtst_path:
+        raise OSError("libX11 and libXtst are required for the xtest backend")
+    x11 = ctypes.CDLL(x11_path)
+    xtst = ctypes.CDLL(xtst_path)
+    x11.XOpenDisplay.argtypes = (ctypes.c_char_p,)
+    x11.XOpenDisplay.restype = ctypes.c_void_p
+    x11.XCloseDisplay.argtypes = (ctypes.c_void_p,)
+    x11.XFlush.argtypes = (ctypes.c_void_p,)
+    x11.XStringToKeysym.argtypes = (ctypes.c_char_p,)
+    x11.XStringToKeysym.restype = ctypes.c_ulong
+    x11.XKeysymToKeycode.argtypes = (ctypes.c_void_p, ctypes.c_ulong)
+    x11.XKeysymToKeycode.restype = ctypes.c_ubyte
+    xtst.XTestFakeKeyEvent.argtypes = (ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_ulong)
+    return x11, xtst
+
+
+class XTestBackend(OutputBackend):
+    """X11 key output through the XTest extension, for games under X11 or Proton.
+
+    Scancodes are translated to X keycodes once when the backend opens the
+    display. A batch is queued with XTestFakeKeyEvent and written to the
+    server with a single XFlush.
+    """
+
+    name = 'xtest'
+
+    def __init__(self, display_name=None):
+        self._x11, xtst = load_xlib()
+        self._fake_key_event = xtst.XTestFakeKeyEvent
+        self._flush = self._x11.XFlush
+        self._display = self._x11.XOpenDisplay(display_name.encode() if display_name else None)
+        if not self._display:
+            raise OSError(f"Cannot open X display {display_name or os.environ.get('DISPLAY')}")
+        self.keycodes = {}
+        for name, scancode in list(SCANCODE_MAP.items()) + list(MODIFIER_SCANCODES.items()):
+            keysym = self._x11.XStringToKeysym(keysym_name(name).encode())
+            keycode = self._x11.XKeysymToKeycode(self._display, keysym) if keysym else 0
+            if keycode:
+                extended = KEYEVENTF_EXTENDEDKEY if scancode > 0xFF else 0
+                self.keycodes[(scancode & 0xFF, extended)] = keycode
+
+    def prepare(self, sequence):
+        prepared = []
+        for scancode, flags in sequence:
+            keycode = self.keycodes.get((scancode, flags & KEYEVENTF_EXTENDEDKEY))
+            if keycode:
+                prepared.append((keycode, 0 if flags & KEYEVENTF_KEYUP else 1))
+        return tuple(prepared)
+
+    def send(self, prepared, deadline_ns=None):
+        if not prepared:
+            return
+        display = self._display
+        fake_key_event = self._fake_key_event
+        for keycode, is_press in prepared:
+            fake_key_event(display, keycode, is_press, 0)
+        self._flush(display)
+
+    def close(self):
+        if self._display:
+            self._x11.XCloseDisplay(self._display)
+            self._display = None
+
+
+OUTPUT_BACKENDS = {
+    'sendinput': SendInputBackend,
+    'xtest': XTestBackend,
+    'null': NullBackend,
+    'recording': RecordingBackend,
+}
+
+
+def default_backend_name():
+    if sys.platform == 'win32':
+        return 'sendinput'
+    if os.environ.get('DISPLAY') and find_library('Xtst'):
+        return 'xtest'
+    return 'null'
+
+
+def create_backend(name='auto'):
+    """Create an output backend by name; 'auto' picks the platform default."""
+    if name in (None, 'auto'):
+        name = default_backend_name()
+    if name not in OUTPUT_BACKENDS:
+        raise ValueError(f"Unknown output backend: {name}")
+    return OUTPUT_BACKENDS[name]()
@@ -10,18 +10,33 @@ TRANSLATIONS = {
         'tab_about': 'About',
         'label_keymap': 'Keymap:',
         'label_midi_files': 'MIDI Files:',
+        'label_search': 'Search...',
+        'label_sort': 'Sort:',
+        'sort_name': 'Name',
+        'sort_duration': 'Duration',
+        'sort_compatibility': 'Compatibility',
         'label_select_file': 'Select a MIDI file',
+        'label_parts': 'Tracks and Channels:',
+        'part_track': 'Track',
+        'part_channel': 'Channel',
+        'part_percussion': 'percussion',
         'label_language': 'Language:',
         'label_speed': 'Speed Multiplier:',
         'label_duration': 'Target Duration (sec):',
         'btn_play': 'Play',
         'btn_stop': 'Stop',
+        'btn_pause': 'Pause',
+        'btn_resume': 'Resume',
         'btn_test_keymap': 'Test Keymap',
         'btn_browse': 'Browse Folder...',
         'status_duration': 'Duration:',
         'status_compatible': '✓ Compatible',
         'status_no_notes': 'No notes',
         'status_mismatch': '⚠ Range mismatch',
+        'status_scanning': 'Scanning library',
+        'label_notes_sent': 'Notes:',
+        'label_notes_dropped': 'Dropped:',
+        'label_lateness': 'Late:',
         'group_speed': 'Playback Speed',
         'group_range': 'Range Mismatch Handling',
         'group_directory': 'MIDI Directory',
@@ -33,6 +48,7 @@ TRANSLATIONS = {
         'mode_align_low': 'Align to Low Key',
         'mode_align_high': 'Align to High Key',
         'mode_optimal': 'Find Optimal Range',
+        'mode_transpose': 'Auto Transpose',
         'mode_speed_mult': 'Use Speed Multiplier (0.1x - 4.0x)',
         'mode_target_dur': 'Use Target Duration (seconds)',
         'group_directory': 'MIDI Directory',
@@ -41,6 +57,14 @@ TRANSLATIONS = {
         'btn_remove_dir': 'Remove',
         'label_topmost': 'Window Topmost:',
         'label_countdown': 'Countdown (seconds):',
+        'label_key_hold': 'Key Hold (ms):',
+        'label_hold_note_off': 'Hold Until Note Off:',
+        'label_fold_octaves': 'Fold Outlying Notes by Octave:',
+        'label_max_polyphony': 'Max Notes per Chord:',
+        'label_max_keys_per_sec': 'Max Key Presses per Second:',
+        'label_reduce_density': 'Thin Dense Passages:',
+        'tip_reduce_density': 'Set Max Key Presses per Second to thin dense passages',
+        'value_unlimited': 'Unlimited',
         'about_title': 'MIDI Player for Games',
         'about_desc': 'A powerful MIDI player designed for playing custom game soundtracks.\n\nFeatures:\n• Multiple keymap profiles\n• Custom playback speeds\n• Flexible note range handling\n• Real-time key mapping\n• Support for .mid and .midi files',
         'btn_github': 'View on GitHub',
@@ -55,6 +79,7 @@ TRANSLATIONS = {
         'msg_success': 'Success',
         'msg_init_failed': 'Failed to initialize player',
         'msg_restart_to_change': 'Restart app to apply change',
+        'msg_keymap_errors': 'Some keymap entries are invalid and were skipped:',
     },
     'th': {
         'app_title': 'เครื่องเล่น MIDI สำหรับเกม',
@@ -65,7 +90,16 @@ TRANSLATIONS = {
 
         'label_keymap': 'ผังแป้นพิมพ์:',
         'label_midi_files': 'ไฟล์ MIDI:',
+        'label_search': 'ค้นหา...',
+        'label_sort': 'เรียงตาม:',
+        'sort_name': 'ชื่อ',
+        'sort_duration': 'ความยาว',
+        'sort_compatibility': 'ความเข้ากันได้',
         'label_select_file': 'เลือกไฟล์ MIDI',
+        'label_parts': 'แทร็กและแชนเนล:',
+        'part_track': 'แทร็ก',
+        'part_channel': 'แชนเนล',
+        'part_percussion': 'เครื่องกระทบ',
 
         'label_language': 'ภาษา:',
         'label_speed': 'ตัวคูณความเร็ว:',
@@ -73,6 +107,8 @@ TRANSLATIONS = {
 
         'btn_play': 'เล่น',
         'btn_stop': 'หยุด',
+        'btn_pause': 'พัก',
+        'btn_resume': 'เล่นต่อ',
         'btn_test_keymap': 'ทดสอบผังแป้นพิมพ์',
         'btn_browse': 'เลือกโฟลเดอร์...',
 
@@ -80,6 +116,10 @@ TRANSLATIONS = {
         'status_compatible': 'ใช้งานได้',
         'status_no_notes': 'ไม่มีโน้ต',
         'status_mismatch': 'ช่วงไม่ตรงกัน',
+        'status_scanning': 'กำลังสแกนไฟล์',
+        'label_notes_sent': 'โน้ต:',
+        'label_notes_dropped': 'ข้าม:',
+        'label_lateness': 'ช้า:',
 
         'group_speed': 'ความเร็วในการเล่น',
         'group_range': 'การจัดการช่วงโน้ตไม่ตรงกัน',
@@ -91,6 +131,7 @@ TRANSLATIONS = {
         'mode_align_low': 'ชิดแป้นต่ำสุด',
         'mode_align_high': 'ชิดแป้นสูงสุด',
         'mode_optimal': 'หาช่วงที่เหมาะสมที่สุด',
+        'mode_transpose': 'เปลี่ยนคีย์อัตโนมัติ',
         'mode_speed_mult': 'ใช้โหมดตัวคูณความเร็ว (0.1x - 4.0x)',
         'mode_target_dur': 'ใช้โหมดกำหนดระยะเวลา (วินาที)',
 
@@ -101,6 +142,14 @@ TRANSLATIONS = {
         'btn_remove_dir': 'ลบ',
         'label_topmost': 'หน้าต่างอยู่ด้านบน:',
         'label_countdown': 'นับถอยหลัง (วินาที):',
+        'label_key_hold': 'ระยะกดค้าง (มิลลิวินาที):',
+        'label_hold_note_off': 'กดค้างจนโน้ตจบ:',
+        'label_fold_octaves': 'ย้ายโน้ตนอกช่วงทีละอ็อกเทฟ:',
+        'label_max_polyphony': 'จำนวนโน้ตสูงสุดต่อคอร์ด:',
+        'label_max_keys_per_sec': 'จำนวนการกดปุ่มสูงสุดต่อวินาที:',
+        'label_reduce_density': 'ลดโน้ตในช่วงที่หนาแน่น:',
+        'tip_reduce_density': 'ตั้งค่าจำนวนการกดปุ่มสูงสุดต่อวินาทีเพื่อลดโน้ตในช่วงที่หนาแน่น',
+        'value_unlimited': 'ไม่จำกัด',
 
         'about_title': 'เครื่องเล่น MIDI สำหรับเกม',
         'about_desc':
@@ -125,6 +174,7 @@ TRANSLATIONS = {
         'msg_success': 'สำเร็จ',
         'msg_init_failed': 'ไม่สามารถเริ่มการทำงานของเครื่องเล่นได้',
         'msg_restart_to_change': 'เริ่มต้นแอปใหม่เพื่อใช้การเปลี่ยนแปลง',
+        'msg_keymap_errors': 'ข้ามรายการในผังแป้นพิมพ์ที่ไม่ถูกต้อง:',
     }
 }
 
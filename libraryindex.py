@@ -0,0 +1,372 @@
+import re
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import compress, repeat
+from operator import contains
+from compatibility import CompatibilityScore
+
+SORT_NAME = 'name'
+SORT_DURATION = 'duration'
+SORT_COMPATIBILITY = 'compatibility'
+SORT_KEYS = (SORT_NAME, SORT_DURATION, SORT_COMPATIBILITY)
+
+# low_notes markers for entries without a usable note range
+NOT_SCANNED = -1
+EMPTY = -2
+FAILED = -3
+
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+# Below this many candidates, sorting the matches beats walking the full sort order
+SMALL_MATCH_FRACTION = 8
+# Once the ranks need a rebuild, matches up to this fraction of the library are sorted by key instead
+KEY_SORT_FRACTION = 32
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def is_broad_query(query):
+    """True when no token of query is long enough to pick candidates from the trigram index."""
+    tokens = TOKEN_PATTERN.findall(query)
+    return bool(tokens) and all(len(token) < 3 for token in tokens)
+
+
+class SortedEntries:
+    """One cached sort order of a LibraryIndex: ids with their folded names and sort keys in order.
+
+    Entries whose info changes are collected with their old keys and moved in one pass when the
+    order is next used or updated, so a scan batch costs one copy of the order instead of a
+    re-sort. Search matches are sorted by rank, a float per id that only has to follow the order:
+    moved entries are ranked between their new neighbours, and the ranks are rebuilt only when a
+    gap runs out.
+    """
+
+    def __init__(self, entry_ids, folded, key_function, id_count):
+        keys = list(map(key_function, entry_ids))
+        positions = sorted(range(len(entry_ids)), key=keys.__getitem__)
+        self.ids = list(map(entry_ids.__getitem__, positions))
+        self.keys = list(map(keys.__getitem__, positions))
+        self.names = list(map(folded.__getitem__, self.ids))
+        self.folded = folded
+        self.key_function = key_function
+        self.id_count = id_count
+        self.changed = {}
+        self.version = 0
+        self._build_rank()
+
+    def change(self, entry_id):
+        """Note an entry before its sort key changes."""
+        if entry_id not in self.changed:
+            self.changed[entry_id] = self.key_function(entry_id)
+
+    def update(self):
+        """Move the changed entries to their new places in one pass over the order."""
+        if not self.changed:
+            return
+        ids, keys, names = self.ids, self.keys, self.names
+        # (position in the old order, 0, new key, id) inserts before that position, (position, 1) drops it
+        cuts = []
+        for entry_id, key in self.changed.items():
+            position = bisect_left(keys, key)
+            while ids[position] != entry_id:
+                position += 1  # Files whose names differ only in case share a key
+            cuts.append((position, 1))
+            key = self.key_function(entry_id)
+            cuts.append((bisect_right(keys, key), 0, key, entry_id))
+        cuts.sort()
+        self.ids, self.keys, self.names = [], [], []
+        inserted = []
+        start = 0
+        for position, drop, *added in cuts:
+            self.ids += ids[start:position]
+            self.keys += keys[start:position]
+            self.names += names[start:position]
+            if drop:
+                start = position + 1
+            else:
+                key, entry_id = added
+                inserted.append(len(self.ids))
+                self.ids.append(entry_id)
+                self.keys.append(key)
+                self.names.append(self.folded[entry_id])
+                start = position
+        self.ids += ids[start:]
+        self.keys += keys[start:]
+        self.names += names[start:]
+        self.changed.clear()
+        self.version += 1
+        if self._rank is not None:
+            self._rerank(inserted)
+
+    def _rerank(self, inserted):
+        """Rank each run of inserted positions evenly between the ranks of its neighbours."""
+        ids, rank = self.ids, self._rank
+        last = len(ids) - 1
+        run_start = 0
+        for i, position in enumerate(inserted):
+            if i + 1 < len(inserted) and inserted[i + 1] == position + 1:
+                continue
+            first = inserted[run_start]
+            count = position - first + 1
+            run_start = i + 1
+            if first == 0 and position == last:
+                self._rank = None
+                return
+            low = rank[ids[first - 1]] if first > 0 else rank[ids[position + 1]] - count - 1
+            high = rank[ids[position + 1]] if position < last else low + count + 1
+            step = (high - low) / (count + 1)
+            if not low < low + step or not low + step * count < high:
+                self._rank = None  # The gap is too narrow for distinct floats
+                return
+            for offset in range(count):
+                rank[ids[first + offset]] = low + step * (offset + 1)
+
+    def sort(self, entry_ids):
+        """Sort a list of ids in place into this order."""
+        if self._rank is None and len(entry_ids) * KEY_SORT_FRACTION < len(self.ids):
+            # A few matches sort by key faster than the ranks are rebuilt
+            entry_ids.sort(key=self.key_function)
+            return
+        if self._rank is None:
+            self._build_rank()
+        entry_ids.sort(key=self._rank.__getitem__)
+
+    def _build_rank(self):
+        rank = array('d', [0.0]) * self.id_count
+        for position, entry_id in enumerate(self.ids):
+            rank[entry_id] = position
+        self._rank = rank
+
+
+class LibraryIndex:
+    """Compact, searchable index of the MIDI library behind the file list.
+
+    Entries live in parallel columns addressed by a stable integer id; ids
+    of removed files are reused. Search keeps an inverted trigram index over
+    lower-cased names, with each posting list a compact int array: the
+    rarest trigram of the query picks the candidates, which are confirmed
+    with substring tests, so a query matches the names that contain all of
+    its tokens. Broad queries walk the cached sort order instead, and a
+    query that extends the previous one only re-checks the previous
+    matches. Cached sort orders stay valid while files are scanned.
+
+    With keymap_count keymaps each entry also holds a row of the keymap
+    compatibility matrix (coverage and playable-note ratio per keymap, see
+    KeymapCompatibility), so switching keymaps or sorting by compatibility
+    never touches the files.
+    """
+
+    def __init__(self, keymap_count=0):
+        self.keymap_count = keymap_count
+        self.clear()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, filename):
+        return filename in self.ids
+
+    def clear(self):
+        self.names = []
+        self.folded = []
+        self.durations = array('d')
+        self.low_notes = array('b')
+        self.high_notes = array('b')
+        self.coverage = array('f')
+        self.playable = array('f')
+        self.best_columns = array('b')
+        self.ids = {}
+        self.free_ids = []
+        self.postings = {}
+        self._orders = {}
+        self._last_filter = None
+
+    def add(self, filename):
+        """Add a file by name and return its id; known names keep their id."""
+        entry_id = self.ids.get(filename)
+        if entry_id is not None:
+            return entry_id
+        folded = filename.lower()
+        if self.free_ids:
+            entry_id = self.free_ids.pop()
+            self.names[entry_id] = filename
+            self.folded[entry_id] = folded
+            self.durations[entry_id] = math.nan
+            self.low_notes[entry_id] = self.high_notes[entry_id] = NOT_SCANNED
+            self._set_scores(entry_id, None, None)
+        else:
+            entry_id = len(self.names)
+            self.names.append(filename)
+            self.folded.append(folded)
+            self.durations.append(math.nan)
+            self.low_notes.append(NOT_SCANNED)
+            self.high_notes.append(NOT_SCANNED)
+            self.coverage.extend(repeat(math.nan, self.keymap_count))
+            self.playable.extend(repeat(math.nan, self.keymap_count))
+            self.best_columns.append(-1)
+        self.ids[filename] = entry_id
+        for trigram in trigrams(folded):
+            posting = self.postings.get(trigram)
+            if posting is None:
+                self.postings[trigram] = array('i', (entry_id,))
+            else:
+                posting.append(entry_id)
+        self._invalidate()
+        return entry_id
+
+    def remove(self, filename):
+        entry_id = self.ids.pop(filename, None)
+        if entry_id is None:
+            return False
+        for trigram in trigrams(self.folded[entry_id]):
+            posting = self.postings[trigram]
+            posting.remove(entry_id)
+            if not posting:
+                del self.postings[trigram]
+        self.names[entry_id] = self.folded[entry_id] = None
+        self.free_ids.append(entry_id)
+        self._invalidate()
+        return True
+
+    def set_info(self, info, scores=None, best_column=None):
+        """Store the duration and note range from a MidiPlayer.get_midi_info() style dict.
+
+        scores and best_column are the file's KeymapCompatibility.scores() row and best() column.
+        """
+        entry_id = self.ids.get(info['filename'])
+        if entry_id is None:
+            return False
+        # Scans report files one by one; the cached orders move them when next used instead of re-sorting
+        for order_key, order in self._orders.items():
+            if order_key[0] != SORT_NAME:
+                order.change(entry_id)
+        if 'error' in info:
+            self.durations[entry_id] = math.nan
+            self.low_notes[entry_id] = self.high_notes[entry_id] = FAILED
+        else:
+            self.durations[entry_id] = info['duration']
+            if info['note_range']:
+                self.low_notes[entry_id], self.high_notes[entry_id] = info['note_range']
+            else:
+                self.low_notes[entry_id] = self.high_notes[entry_id] = EMPTY
+        self._set_scores(entry_id, scores, best_column)
+        return True
+
+    def _set_scores(self, entry_id, scores, best_column):
+        start = entry_id * self.keymap_count
+        for column in range(self.keymap_count):
+            score = scores[column] if scores else None
+            self.coverage[start + column] = score.coverage if score else math.nan
+            self.playable[start + column] = score.playable_ratio if score else math.nan
+        self.best_columns[entry_id] = -1 if best_column is None else best_column
+
+    def duration(self, entry_id):
+        """Duration in seconds, or None until the file is scanned."""
+        duration = self.durations[entry_id]
+        return None if math.isnan(duration) else duration
+
+    def failed(self, entry_id):
+        return self.low_notes[entry_id] == FAILED
+
+    def score(self, entry_id, column):
+        """CompatibilityScore of an entry against the keymap in column, or None before it is scanned."""
+        if column is None:
+            return None
+        cell = entry_id * self.keymap_count + column
+        if math.isnan(self.playable[cell]):
+            return None
+        return CompatibilityScore(self.coverage[cell], self.playable[cell])
+
+    def best_column(self, entry_id):
+        """Column of the keymap that plays most of the entry's notes, or None."""
+        column = self.best_columns[entry_id]
+        return None if column < 0 else column
+
+    def _invalidate(self):
+        self._orders.clear()
+        self._last_filter = None
+
+    def _sort_function(self, sort_key, keymap_column):
+        folded = self.folded
+        if sort_key == SORT_DURATION:
+            durations = self.durations
+
+            def duration_key(i):
+                duration = durations[i]
+                if math.isnan(duration):
+                    return True, 0.0, folded[i]  # Unscanned files last
+                return False, duration, folded[i]
+            return duration_key
+        if sort_key == SORT_COMPATIBILITY and keymap_column is not None:
+            playable, coverage = self.playable, self.coverage
+            keymap_count = self.keymap_count
+
+            def compatibility_key(i):
+                cell = i * keymap_count + keymap_column
+                if math.isnan(playable[cell]):
+                    return True, 0.0, 0.0, folded[i]  # Unscanned files and files without notes last
+                return False, -playable[cell], -coverage[cell], folded[i]
+            return compatibility_key
+        return folded.__getitem__
+
+    def _order_key(self, sort_key, keymap_column):
+        return sort_key, keymap_column if sort_key == SORT_COMPATIBILITY else None
+
+    def _sorted(self, sort_key, keymap_column):
+        """SortedEntries for sort_key, cached until files are added or removed."""
+        order_key = self._order_key(sort_key, keymap_column)
+        cached = self._orders.get(order_key)
+        if cached is None:
+            cached = SortedEntries(list(self.ids.values()), self.folded,
+                                   self._sort_function(sort_key, keymap_column), len(self.names))
+            self._orders[order_key] = cached
+        else:
+            cached.update()
+        return cached
+
+    def update_orders(self):
+        """Move the entries changed by set_info() within every cached sort order.
+
+        Orders also catch up when next used; calling this after each scan batch keeps that work off
+        the next keystroke.
+        """
+        for order in self._orders.values():
+            order.update()
+
+    def order(self, sort_key=SORT_NAME, keymap_column=None):
+        """All ids sorted by sort_key."""
+        return list(self._sorted(sort_key, keymap_column).ids)
+
+    def filter(self, query='', sort_key=SORT_NAME, keymap_column=None):
+        """Ids whose names contain every token of query, in sort_key order."""
+        folded_query = query.lower()
+        tokens = TOKEN_PATTERN.findall(folded_query)
+        order = self._sorted(sort_key, keymap_column)
+        if not tokens:
+            # A copy: the cached order is updated in place as files are scanned
+            return list(order.ids)
+        order_key = self._order_key(sort_key, keymap_column)
+        last = self._last_filter
+        if last is not None and last[1] == order_key and folded_query.startswith(last[0]):
+            # Extending a query can only narrow its matches, which stay sorted unless a scan moved entries
+            rows, names, ordered = last[3], last[4], last[2] == order.version
+        else:
+            rows, names, ordered = order.ids, order.names, True
+            posting = min((self.postings.get(trigram, ()) for token in tokens for trigram in trigrams(token)),
+                          key=len, default=None)
+            if posting is not None and len(posting) * SMALL_MATCH_FRACTION < len(self.ids):
+                # The rarest trigram narrows the candidates enough to confirm them first and sort the matches
+                rows, ordered = posting, False
+                names = list(map(self.folded.__getitem__, rows))
+        for token in tokens:
+            # Substring tests run in C: map contains() over the names, compress the ids
+            keep = list(map(contains, names, repeat(token)))
+            rows = list(compress(rows, keep))
+            names = list(compress(names, keep))
+        if not ordered:
+            order.sort(rows)
+            names = list(map(self.folded.__getitem__, rows))
+        self._last_filter = (folded_query, order_key, order.version, rows, names)
+        return rows
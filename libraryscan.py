@@ -0,0 +1,100 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from midicache import analyze_midi
+
+SCAN_CHUNK_SIZE = 16
+CACHED_BATCH_SIZE = 500
+
+
+def analyze_chunk(filepaths):
+    """Worker entry point: analyze a batch of files, never raising for a bad file."""
+    results = []
+    for filepath in filepaths:
+        try:
+            entry = analyze_midi(filepath)
+        except Exception as e:
+            entry = {'error': str(e)}
+        results.append((filepath, entry))
+    return results
+
+
+class LibraryScanner:
+    """Analyze MIDI files across a process pool and stream results back as they finish.
+
+    Files whose cache entry is still valid are reported straight away; only
+    stale or new files are sent to the workers.
+    """
+
+    def __init__(self, cache, max_workers=None):
+        self.cache = cache
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def scan(self, filepaths, on_results, on_progress=None):
+        """Scan filepaths, calling on_results with lists of (filepath, entry).
+
+        Returns False if the scan was cancelled before finishing.
+        """
+        total = len(filepaths)
+        done = 0
+        batch = []
+        stale = {}
+        for filepath in filepaths:
+            if self.cancelled:
+                return False
+            try:
+                signature = self.cache.file_signature(filepath)
+            except OSError as e:
+                batch.append((filepath, {'error': str(e)}))
+                continue
+            entry = self.cache.lookup(filepath, signature)
+            if entry is None:
+                stale[filepath] = signature
+            else:
+                batch.append((filepath, entry))
+            if len(batch) >= CACHED_BATCH_SIZE:
+                done += len(batch)
+                self._report(batch, done, total, on_results, on_progress)
+                batch = []
+        if batch:
+            done += len(batch)
+            self._report(batch, done, total, on_results, on_progress)
+        if not stale:
+            return True
+
+        paths = list(stale)
+        chunks = [paths[i:i + SCAN_CHUNK_SIZE] for i in range(0, len(paths), SCAN_CHUNK_SIZE)]
+        if len(chunks) == 1 or self.max_workers == 1:
+            # Not worth starting worker processes for a handful of files
+            for chunk in chunks:
+                if self.cancelled:
+                    return False
+                done += len(chunk)
+                self._store_and_report(analyze_chunk(chunk), stale, done, total, on_results, on_progress)
+            return True
+
+        with ProcessPoolExecutor(max_workers=min(self.max_workers, len(chunks))) as executor:
+            futures = [executor.submit(analyze_chunk, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                if self.cancelled:
+                    for pending in futures:
+                        pending.cancel()
+                    return False
+                results = future.result()
+                done += len(results)
+                self._store_and_report(results, stale, done, total, on_results, on_progress)
+        return True
+
+    def _store_and_report(self, results, signatures, done, total, on_results, on_progress):
+        stored = [(filepath, self.cache.store(filepath, entry, signatures[filepath]))
+                  for filepath, entry in results]
+        self._report(stored, done, total, on_results, on_progress)
+
+    @staticmethod
+    def _report(results, done, total, on_results, on_progress):
+        on_results(results)
+        if on_progress:
+            on_progress(done, total)
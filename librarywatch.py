@@ -0,0 +1,336 @@
+import os
+import sys
+import time
+import ctypes
+import select
+import threading
+from ctypes.util import find_library
+
+ADDED = 'added'
+REMOVED = 'removed'
+MODIFIED = 'modified'
+
+MIDI_EXTENSIONS = (".mid", ".midi")
+# Directories without native notifications are rescanned this often
+DEFAULT_POLL_INTERVAL = 2.0
+# Wait after a notification so a burst (e.g. a file being copied) is handled as one rescan
+SETTLE_SECONDS = 0.3
+
+
+def scan_directory(directory):
+    """Return {filename: (mtime_ns, size)} for the MIDI files directly in directory."""
+    listing = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith(MIDI_EXTENSIONS):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                listing[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        pass
+    return listing
+
+
+def diff_listings(directory, old, new):
+    """Return (kind, filepath) changes between two scan_directory listings."""
+    changes = []
+    for filename, signature in new.items():
+        previous = old.get(filename)
+        if previous is None:
+            changes.append((ADDED, os.path.join(directory, filename)))
+        elif previous != signature:
+            changes.append((MODIFIED, os.path.join(directory, filename)))
+    for filename in old:
+        if filename not in new:
+            changes.append((REMOVED, os.path.join(directory, filename)))
+    return changes
+
+
+class PollingNotifier:
+    """Fallback notifier: watches nothing natively, so every directory is polled."""
+
+    name = 'polling'
+
+    def __init__(self):
+        self._wake = threading.Event()
+
+    def add(self, directory):
+        return False
+
+    def remove(self, directory):
+        pass
+
+    def is_watching(self, directory):
+        return False
+
+    def wait(self, timeout):
+        """Block up to timeout seconds; returns the directories that reported changes."""
+        self._wake.wait(timeout)
+        self._wake.clear()
+        return set()
+
+    def wake(self):
+        self._wake.set()
+
+    def close(self):
+        pass
+
+
+class InotifyNotifier:
+    """Linux inotify notifier, read through ctypes with a self-pipe for wake-ups."""
+
+    name = 'inotify'
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_IGNORED = 0x8000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                  | IN_DELETE_SELF | IN_MOVE_SELF)
+
+    def __init__(self):
+        libc = ctypes.CDLL(find_library('c') or 'libc.so.6', use_errno=True)
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._wake_read, self._wake_write = os.pipe()
+        self.watches = {}
+        self.directories = {}
+
+    def add(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd < 0:
+            return False
+        self.watches[wd] = directory
+        self.directories[directory] = wd
+        return True
+
+    def remove(self, directory):
+        wd = self.directories.pop(directory, None)
+        if wd is not None:
+            self.watches.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def is_watching(self, directory):
+        return directory in self.directories
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd, self._wake_read], [], [], timeout)
+        if self._wake_read in readable:
+            os.read(self._wake_read, 4096)
+        if self.fd not in readable:
+            return set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set()
+        dirty = set()
+        pos = 0
+        while pos + 16 <= len(data):
+            wd = int.from_bytes(data[pos:pos + 4], sys.byteorder, signed=True)
+            mask = int.from_bytes(data[pos + 4:pos + 8], sys.byteorder)
+            name_length = int.from_bytes(data[pos + 12:pos + 16], sys.byteorder)
+            pos += 16 + name_length
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            dirty.add(directory)
+            if mask & self.IN_IGNORED:
+                # The directory itself went away; it is polled until it comes back
+                self.watches.pop(wd, None)
+                self.directories.pop(directory, None)
+        return dirty
+
+    def wake(self):
+        os.write(self._wake_write, b'\0')
+
+    def close(self):
+        os.close(self.fd)
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+
+
+class WindowsChangeNotifier:
+    """Windows notifier built on FindFirstChangeNotification wait handles."""
+
+    name = 'win32'
+    FILE_NOTIFY_CHANGE_FILE_NAME = 0x01
+    FILE_NOTIFY_CHANGE_SIZE = 0x08
+    FILE_NOTIFY_CHANGE_LAST_WRITE = 0x10
+    WAIT_OBJECT_0 = 0x000
+    WAIT_TIMEOUT = 0x102
+    MAXIMUM_WAIT_OBJECTS = 64
+    INVALID_HANDLE_VALUE = ctypes.c_void_p(-1).value
+
+    def __init__(self):
+        from ctypes import wintypes
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        kernel32.FindFirstChangeNotificationW.argtypes = (wintypes.LPCWSTR, wintypes.BOOL, wintypes.DWORD)
+        kernel32.FindFirstChangeNotificationW.restype = wintypes.HANDLE
+        kernel32.FindNextChangeNotification.argtypes = (wintypes.HANDLE,)
+        kernel32.FindCloseChangeNotification.argtypes = (wintypes.HANDLE,)
+        kernel32.WaitForMultipleObjects.argtypes = (wintypes.DWORD, ctypes.POINTER(wintypes.HANDLE),
+                                                    wintypes.BOOL, wintypes.DWORD)
+        kernel32.WaitForMultipleObjects.restype = wintypes.DWORD
+        kernel32.CreateEventW.argtypes = (ctypes.c_void_p, wintypes.BOOL, wintypes.BOOL, wintypes.LPCWSTR)
+        kernel32.CreateEventW.restype = wintypes.HANDLE
+        kernel32.SetEvent.argtypes = (wintypes.HANDLE,)
+        kernel32.ResetEvent.argtypes = (wintypes.HANDLE,)
+        kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+        self.kernel32 = kernel32
+        self.handle_type = wintypes.HANDLE
+        self.wake_event = kernel32.CreateEventW(None, True, False, None)
+        self.handles = {}
+
+    def add(self, directory):
+        if len(self.handles) >= self.MAXIMUM_WAIT_OBJECTS - 1:
+            return False
+        handle = self.kernel32.FindFirstChangeNotificationW(
+            directory, False,
+            self.FILE_NOTIFY_CHANGE_FILE_NAME | self.FILE_NOTIFY_CHANGE_SIZE | self.FILE_NOTIFY_CHANGE_LAST_WRITE)
+        if not handle or handle == self.INVALID_HANDLE_VALUE:
+            return False
+        self.handles[directory] = handle
+        return True
+
+    def remove(self, directory):
+        handle = self.handles.pop(directory, None)
+        if handle is not None:
+            self.kernel32.FindCloseChangeNotification(handle)
+
+    def is_watching(self, directory):
+        return directory in self.handles
+
+    def wait(self, timeout):
+        directories = list(self.handles)
+        handles = (self.handle_type * (len(directories) + 1))(self.wake_event, *(self.handles[d] for d in directories))
+        result = self.kernel32.WaitForMultipleObjects(len(handles), handles, False, int(timeout * 1000))
+        index = result - self.WAIT_OBJECT_0
+        if result == self.WAIT_TIMEOUT or not 0 <= index < len(handles):
+            return set()
+        if index == 0:
+            self.kernel32.ResetEvent(self.wake_event)
+            return set()
+        directory = directories[index - 1]
+        if not self.kernel32.FindNextChangeNotification(self.handles[directory]):
+            # The directory went away; it is polled until it comes back
+            self.remove(directory)
+        return {directory}
+
+    def wake(self):
+        self.kernel32.SetEvent(self.wake_event)
+
+    def close(self):
+        for directory in list(self.handles):
+            self.remove(directory)
+        self.kernel32.CloseHandle(self.wake_event)
+
+
+def create_notifier():
+    """Best native notifier for this platform, falling back to polling."""
+    try:
+        if sys.platform == 'win32':
+            return WindowsChangeNotifier()
+        if sys.platform.startswith('linux'):
+            return InotifyNotifier()
+    except (OSError, AttributeError):
+        pass
+    return PollingNotifier()
+
+
+class LibraryWatcher(threading.Thread):
+    """Background watcher that reports MIDI file changes in a set of directories.
+
+    Native notifications (inotify, or change handles on Windows) only say
+    which directory changed; that directory is then rescanned and diffed
+    against its last listing, so on_changes receives exact
+    (ADDED | REMOVED | MODIFIED, filepath) deltas. Directories without a
+    native watch are rescanned every poll_interval seconds. on_changes runs
+    on the watcher thread.
+    """
+
+    def __init__(self, directories, on_changes, poll_interval=DEFAULT_POLL_INTERVAL, notifier=None):
+        super().__init__(name="LibraryWatcher", daemon=True)
+        self.on_changes = on_changes
+        self.poll_interval = poll_interval
+        self.notifier = notifier or create_notifier()
+        self.listings = {}
+        self.unwatched = set()
+        self._lock = threading.Lock()
+        self._requested_directories = None
+        self._stopped = False
+        for directory in directories:
+            self._watch(directory)
+            self.listings[directory] = scan_directory(directory)
+
+    def set_directories(self, directories):
+        """Switch to a new directory list; files of added or removed directories are reported as changes."""
+        with self._lock:
+            self._requested_directories = list(directories)
+        self.notifier.wake()
+
+    def stop(self):
+        self._stopped = True
+        self.notifier.wake()
+
+    def run(self):
+        try:
+            next_poll = time.monotonic() + self.poll_interval
+            while not self._stopped:
+                dirty = self.notifier.wait(max(next_poll - time.monotonic(), 0))
+                if self._stopped:
+                    break
+                changes = self._apply_requested_directories()
+                if time.monotonic() >= next_poll:
+                    dirty |= self.unwatched
+                    next_poll = time.monotonic() + self.poll_interval
+                dirty &= set(self.listings)
+                if dirty:
+                    time.sleep(SETTLE_SECONDS)
+                    dirty |= self.notifier.wait(0) & set(self.listings)
+                    for directory in dirty:
+                        if not self.notifier.is_watching(directory):
+                            self._watch(directory)
+                        listing = scan_directory(directory)
+                        changes += diff_listings(directory, self.listings[directory], listing)
+                        self.listings[directory] = listing
+                if changes:
+                    self.on_changes(changes)
+        finally:
+            self.notifier.close()
+
+    def _watch(self, directory):
+        if self.notifier.add(directory):
+            self.unwatched.discard(directory)
+        else:
+            self.unwatched.add(directory)
+
+    def _apply_requested_directories(self):
+        with self._lock:
+            requested, self._requested_directories = self._requested_directories, None
+        if requested is None:
+            return []
+        changes = []
+        for directory in [d for d in self.listings if d not in requested]:
+            self.notifier.remove(directory)
+            self.unwatched.discard(directory)
+            changes += diff_listings(directory, self.listings.pop(directory), {})
+        for directory in requested:
+            if directory not in self.listings:
+                self._watch(directory)
+                listing = scan_directory(directory)
+                self.listings[directory] = listing
+                changes += diff_listings(directory, {}, listing)
+        return changes
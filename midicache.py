@@ -0,0 +1,177 @@
+import os
+import json
+import threading
+from midistream import MidiNoteStream
+from settingsstore import atomic_write_text
+
+CACHE_VERSION = 3
+# Parts shorter than this are rated as if they lasted this long, so one chord is not "dense"
+MIN_DENSITY_SPAN = 1.0
+
+
+def analyze_midi(filepath):
+    """Stream a MIDI file once and return its cacheable metadata.
+
+    'parts' holds [track, channel, note_count, low, high, first_time,
+    last_time, histogram] for every channel of every track that plays
+    notes, and 'track_names' the names of named tracks, keyed by
+    str(track). Histograms are sparse {str(note): count} dicts.
+    """
+    stream = MidiNoteStream(filepath)
+    histogram = {}
+    parts = {}
+    event_count = 0
+    for seconds, track, channel, note, velocity in stream.iter_notes(with_tracks=True):
+        if velocity and note <= 127:
+            histogram[note] = histogram.get(note, 0) + 1
+            event_count += 1
+            part = parts.get((track, channel))
+            if part is None:
+                parts[(track, channel)] = [track, channel, 1, note, note, seconds, seconds, {note: 1}]
+            else:
+                part[2] += 1
+                if note < part[3]:
+                    part[3] = note
+                elif note > part[4]:
+                    part[4] = note
+                part[6] = seconds
+                part[7][note] = part[7].get(note, 0) + 1
+    for part in parts.values():
+        part[7] = {str(note): count for note, count in part[7].items()}
+    return {
+        'duration': stream.length,
+        'note_range': [min(histogram), max(histogram)] if histogram else None,
+        'histogram': {str(note): count for note, count in histogram.items()},
+        'event_count': event_count,
+        'parts': sorted(parts.values()),
+        'track_names': {str(track): name for track, name in stream.track_names.items()},
+    }
+
+
+def summarize_parts(entry, by):
+    """Group an entry's parts by 'track' or 'channel' into stats dicts, in index order.
+
+    Each dict has the track or channel index, note_count, note_range,
+    density (notes per second between its first and last note) and the
+    other dimension's indices it spans as 'channels' or 'tracks'.
+    """
+    key_field, other_field = (0, 1) if by == 'track' else (1, 0)
+    groups = {}
+    for part in entry.get('parts', []):
+        key = part[key_field]
+        group = groups.get(key)
+        if group is None:
+            groups[key] = group = [0, 127, 0, part[5], part[6], []]
+        group[0] += part[2]
+        group[1] = min(group[1], part[3])
+        group[2] = max(group[2], part[4])
+        group[3] = min(group[3], part[5])
+        group[4] = max(group[4], part[6])
+        group[5].append(part[other_field])
+    stats = []
+    for key in sorted(groups):
+        note_count, low, high, first_time, last_time, others = groups[key]
+        stats.append({
+            by: key,
+            'note_count': note_count,
+            'note_range': (low, high),
+            'density': note_count / max(last_time - first_time, MIN_DENSITY_SPAN),
+            'tracks' if by == 'channel' else 'channels': sorted(others),
+        })
+    return stats
+
+
+def histogram_list(entry, excluded_tracks=(), excluded_channels=()):
+    """Expand an entry's sparse histogram into a 128-bin list of note counts.
+
+    Notes of excluded_tracks and excluded_channels are not counted.
+    """
+    parts = entry.get('parts', [])
+    selected = [part for part in parts if part[0] not in excluded_tracks and part[1] not in excluded_channels]
+    histograms = [entry.get('histogram', {})] if len(selected) == len(parts) else [part[7] for part in selected]
+    bins = [0] * 128
+    for histogram in histograms:
+        for note, count in histogram.items():
+            bins[int(note)] += count
+    return bins
+
+
+class MidiMetadataCache:
+    """Persistent per-file MIDI metadata index keyed by path, mtime and size.
+
+    The scanner stores and saves from its own thread while the library
+    watcher discards entries from another, so changes to entries and the
+    snapshot save() writes are taken under one lock.
+    """
+
+    def __init__(self, cache_file='midi_cache.json'):
+        self.cache_file = cache_file
+        self.entries = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_file, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if data.get('version') == CACHE_VERSION:
+            self.entries = data.get('files', {})
+
+    def save(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            text = json.dumps({'version': CACHE_VERSION, 'files': self.entries}, separators=(',', ':'))
+            self.dirty = False
+        try:
+            atomic_write_text(self.cache_file, text)
+        except Exception as e:
+            self.dirty = True
+            print(f"Error saving MIDI cache: {e}")
+
+    @staticmethod
+    def file_signature(filepath):
+        stat = os.stat(filepath)
+        return stat.st_mtime_ns, stat.st_size
+
+    def lookup(self, filepath, signature=None):
+        """Return the cached entry if it is still valid for the file on disk, else None."""
+        key = os.path.abspath(filepath)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if signature is None:
+            try:
+                signature = self.file_signature(filepath)
+            except OSError:
+                return None
+        if (entry['mtime_ns'], entry['size']) != signature:
+            return None
+        return entry
+
+    def store(self, filepath, entry, signature):
+        entry = dict(entry, mtime_ns=signature[0], size=signature[1])
+        with self._lock:
+            self.entries[os.path.abspath(filepath)] = entry
+            self.dirty = True
+        return entry
+
+    def get(self, filepath):
+        """Return metadata for a file, parsing it only if the cached copy is stale."""
+        signature = self.file_signature(filepath)
+        entry = self.lookup(filepath, signature)
+        if entry is not None:
+            return entry
+        try:
+            entry = analyze_midi(filepath)
+        except Exception as e:
+            entry = {'error': str(e)}
+        return self.store(filepath, entry, signature)
+
+    def discard(self, filepath):
+        with self._lock:
+            if self.entries.pop(os.path.abspath(filepath), None) is not None:
+                self.dirty = True
@@ -0,0 +1,465 @@
+from array import array
+from collections import namedtuple, deque
+from itertools import compress, repeat
+from operator import add
+from keycodes import CompiledKeymap, PLAN_EXTENDED, PLAN_KEYUP
+from midistream import MidiParts
+
+PlanEvent = namedtuple('PlanEvent', ['time', 'scancode', 'flags'])
+
+# Note table entry for notes the range mode discards
+DISCARD = None
+
+DEFAULT_KEYMAP_OPTIONS = {
+    'hold_ms': 10,
+    'hold_until_note_off': False,
+    'max_keys_per_sec': 0,
+    'min_repress_ms': 0,
+    'coalesce_ms': 0,
+    'budget_policy': 'drop',
+    'fold_octaves': True,
+    'max_polyphony': 0,
+    'reduce_density': False,
+}
+
+BUDGET_POLICIES = ('drop', 'defer')
+RANGE_MODES = (1, 2, 3, 4, 5, 6, 7)
+# Mode 7 scores a note folded in by octaves as this much of one that lands on a key as transposed
+FOLD_WEIGHT = 0.5
+# Histogram padding so every shifted index used by find_best_transposition stays in bounds
+TRANSPOSE_PAD = 256
+# Furthest the 'defer' policy may push a press before dropping it instead
+MAX_DEFER_MS = 50
+# Presses starting this close together count as one chord for polyphony reduction
+CHORD_WINDOW_MS = 15
+
+
+class PlaybackPlan:
+    """Flat, precomputed key events for one MIDI file, stored as typed columns.
+
+    Event times are absolute seconds on the file's own timeline and the
+    player scales them by the speed multiplier. Key-up events are compiled
+    for a given speed so hold lengths stay constant in wall-clock time.
+    times, scancodes and flags are parallel array.array columns (10 bytes
+    per event); iterating yields plain (time, scancode, flags) tuples.
+    transpose is the semitone shift range mode 7 chose, 0 otherwise, and
+    reduced counts the notes removed by polyphony reduction.
+    """
+
+    def __init__(self, filepath, times, scancodes, flags, length, note_range, range_mode, dropped=0, deferred=0,
+                 note_count=0, transpose=0, reduced=0):
+        self.filepath = filepath
+        self.times = times
+        self.scancodes = scancodes
+        self.flags = flags
+        self.length = length
+        self.note_range = note_range
+        self.range_mode = range_mode
+        self.dropped = dropped
+        self.deferred = deferred
+        self.note_count = note_count
+        self.transpose = transpose
+        self.reduced = reduced
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        return zip(self.times, self.scancodes, self.flags)
+
+    def __getitem__(self, index):
+        return PlanEvent(self.times[index], self.scancodes[index], self.flags[index])
+
+    @property
+    def events(self):
+        """The plan as a tuple of PlanEvent, built on demand for inspection."""
+        return tuple(PlanEvent(*event) for event in self)
+
+    @property
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in (self.times, self.scancodes, self.flags))
+
+    @property
+    def has_notes(self):
+        return self.note_range is not None
+
+    @property
+    def notes_dropped(self):
+        """Notes in the file that the plan does not press (range mode, reduction, input budget or merged presses)."""
+        # Every press compiles to one key-down and one key-up
+        return self.note_count - len(self.times) // 2
+
+
+def scale_note(note, old_min, old_max, new_min, new_max):
+    if old_max == old_min:
+        return new_min
+    scaled = (note - old_min) * (new_max - new_min) / (old_max - old_min) + new_min
+    return int(round(scaled))
+
+
+def get_nearest_key(note, note_to_key):
+    return note_to_key[min(note_to_key.keys(), key=lambda x: abs(x - note))]
+
+
+def find_optimal_range(histogram, min_key, max_key):
+    """Find the keymap-wide window of MIDI notes that holds the most note events.
+
+    histogram is a 128-bin list of note_on counts. A prefix-sum sliding
+    window as wide as the keymap is scored by the events it contains, so the
+    winning window maps onto the keymap one semitone per key. Ties go to the
+    window needing the smallest transposition.
+    """
+    width = min(max_key - min_key + 1, 128)
+    prefix = [0]
+    for count in histogram:
+        prefix.append(prefix[-1] + count)
+    if not prefix[-1]:
+        return 0, 127
+
+    best_start = 0
+    best_score = None
+    for start in range(128 - width + 1):
+        score = (prefix[start + width] - prefix[start], -abs(start - min_key))
+        if best_score is None or score > best_score:
+            best_score = score
+            best_start = start
+    return best_start, best_start + width - 1
+
+
+def fold_octave(note, min_key, max_key):
+    """Move a note outside [min_key, max_key] by whole octaves to the nearest in-range pitch, or None."""
+    if note < min_key:
+        note += 12 * -(-(min_key - note) // 12)
+    elif note > max_key:
+        note -= 12 * -(-(note - max_key) // 12)
+    return note if min_key <= note <= max_key else None
+
+
+def find_best_transposition(histogram, key_notes, fold_octaves=True):
+    """Find the semitone shift that puts the most note events on actual keys.
+
+    histogram is a 128-bin list of note_on counts and key_notes the keymap's
+    note numbers. Every shift from -127 to +127 is scored by the events
+    that land exactly on a key; with fold_octaves, events outside the keymap
+    range that land on a key once folded by octaves add FOLD_WEIGHT each.
+    Only real keys score, so for keymaps without black keys (such as
+    genshin_mapping) shifts that keep accidentals off the black keys win.
+    Each shift is two C-level sums over a padded histogram, gathered with
+    map(); ties go to the smallest shift.
+    """
+    if not key_notes or not any(histogram):
+        return 0
+    min_key, max_key = min(key_notes), max(key_notes)
+    keys = frozenset(key_notes)
+    # Shifted pitches outside the range that fold onto a key
+    fold_sources = [pitch for pitch in range(-127, 255)
+                    if not min_key <= pitch <= max_key and fold_octave(pitch, min_key, max_key) in keys]
+    padded = [0] * TRANSPOSE_PAD + list(histogram) + [0] * TRANSPOSE_PAD
+    gather = padded.__getitem__
+    best_shift = 0
+    best_score = None
+    for shift in range(-127, 128):
+        # Source note for shifted pitch p is p - shift, at padded index p + offset
+        offset = TRANSPOSE_PAD - shift
+        score = sum(map(gather, map(add, key_notes, repeat(offset))))
+        if fold_octaves:
+            score += FOLD_WEIGHT * sum(map(gather, map(add, fold_sources, repeat(offset))))
+        score = (score, -abs(shift))
+        if best_score is None or score > best_score:
+            best_score = score
+            best_shift = shift
+    return best_shift
+
+
+def map_note(note, keymap, range_mode, old_min, old_max, min_key, max_key, transpose=0, fold_octaves=False):
+    """Return the key string for a note under the given range mode, or None to discard it.
+
+    transpose is only used by mode 7, fold_octaves by modes 6 and 7.
+    """
+    if range_mode == 1:
+        note = scale_note(note, old_min, old_max, min_key, max_key)
+    elif range_mode == 6:
+        # The window is as wide as the keymap and maps key-for-key; clamping the notes
+        # outside it would pile them onto the edge keys
+        note += min_key - old_min
+        if note < min_key or note > max_key:
+            note = fold_octave(note, min_key, max_key) if fold_octaves else None
+            if note is None:
+                return None
+    elif range_mode == 3:
+        if note < min_key or note > max_key:
+            return None
+    elif range_mode == 4:
+        note += min_key - old_min
+        if note > max_key:
+            return None
+    elif range_mode == 5:
+        note += max_key - old_max
+        if note < min_key:
+            return None
+    elif range_mode == 7:
+        note += transpose
+        if note < min_key or note > max_key:
+            note = fold_octave(note, min_key, max_key) if fold_octaves else None
+            if note is None:
+                return None
+    if note in keymap:
+        return keymap[note]
+    return get_nearest_key(note, keymap)
+
+
+def build_note_table(keymap, range_mode, old_min, old_max, transpose=0, fold_octaves=False):
+    """Precompute map_note for all 128 MIDI notes.
+
+    Returns a 128-tuple of key strings, with DISCARD for notes the range
+    mode drops, so mapping a note during compilation is one index.
+    """
+    min_key, max_key = min(keymap), max(keymap)
+    return tuple(
+        map_note(note, keymap, range_mode, old_min, old_max, min_key, max_key, transpose, fold_octaves)
+        for note in range(128)
+    )
+
+
+def rank_voices(chord, notes, velocities):
+    """Order a chord's press indices by importance: top note, bottom note, then loudest and most outlying."""
+    top = max(chord, key=notes.__getitem__)
+    bottom = min(chord, key=notes.__getitem__)
+    middle = (notes[top] + notes[bottom]) / 2
+    inner = sorted((i for i in chord if i != top and i != bottom),
+                   key=lambda i: (-velocities[i], -abs(notes[i] - middle), i))
+    return [top] + inner if top == bottom else [top, bottom] + inner
+
+
+def reduce_polyphony(presses, notes, velocities, max_polyphony=0, max_keys_per_sec=0,
+                     chord_window=CHORD_WINDOW_MS / 1000, rate_window=1.0):
+    """Thin time-ordered [down_time, scancode, flags, note_off_time] presses down to their important voices.
+
+    notes and velocities are the source MIDI note and velocity of each press.
+    Presses starting within chord_window seconds of a chord's first press form
+    one chord. Presses of a chord that landed on the same key collapse into
+    the earliest one, which keeps the loudest velocity and latest note_off.
+    Chords are then cut to max_polyphony voices and, with max_keys_per_sec,
+    each chord keeps only its share of the budget for the rate_window around
+    it, so dense passages lose inner voices instead of whole beats. See
+    rank_voices for the order voices are kept in; a chord never loses its top
+    note.
+
+    Returns (presses in time order, removed count).
+    """
+    chords = []
+    chord_start = None
+    for i, press in enumerate(presses):
+        if chord_start is not None and press[0] - chord_start <= chord_window:
+            chords[-1].append(i)
+        else:
+            chords.append([i])
+            chord_start = press[0]
+    velocities = list(velocities)
+    for position, chord in enumerate(chords):
+        if len(chord) == 1:
+            continue
+        voices = {}
+        for i in chord:
+            physical_key = (presses[i][1], presses[i][2] & PLAN_EXTENDED)
+            kept = voices.get(physical_key)
+            if kept is None:
+                voices[physical_key] = i
+                continue
+            velocities[kept] = max(velocities[kept], velocities[i])
+            off_time = presses[i][3]
+            if off_time is not None and (presses[kept][3] is None or off_time > presses[kept][3]):
+                presses[kept][3] = off_time
+        chord = rank_voices(list(voices.values()), notes, velocities)
+        if max_polyphony:
+            chord = chord[:max_polyphony]
+        chords[position] = chord
+    if max_keys_per_sec:
+        # Presses within half a rate_window either side of each chord, from a running total
+        starts = [presses[chord[0]][0] for chord in chords]
+        totals = [0]
+        for chord in chords:
+            totals.append(totals[-1] + len(chord))
+        low = high = 0
+        for position, chord in enumerate(chords):
+            while starts[low] < starts[position] - rate_window / 2:
+                low += 1
+            while high < len(chords) and starts[high] <= starts[position] + rate_window / 2:
+                high += 1
+            demand = totals[high] - totals[low]
+            if demand > max_keys_per_sec:
+                chords[position] = chord[:max(1, round(len(chord) * max_keys_per_sec / demand))]
+    kept = sorted(i for chord in chords for i in chord)
+    return [presses[i] for i in kept], len(presses) - len(kept)
+
+
+def apply_input_budget(presses, max_keys_per_sec=0, min_repress=0.0, coalesce=0.0, policy='drop',
+                       max_defer=MAX_DEFER_MS / 1000, rate_window=1.0):
+    """Fit time-ordered [down_time, scancode, flags, note_off_time] presses into an input budget.
+
+    Presses starting within coalesce seconds of a group's first press join it
+    as one chord. A press that comes sooner than min_repress after the last
+    press of the same key, or that would exceed max_keys_per_sec within any
+    rate_window seconds, is over budget: 'drop' removes it and 'defer' moves it
+    to the earliest time within budget, dropping it if that is more than
+    max_defer away. Times are plan seconds, so callers scale every duration
+    (including rate_window) by the speed multiplier.
+
+    Returns (presses sorted by time, dropped count, deferred count).
+    """
+    if policy not in BUDGET_POLICIES:
+        raise ValueError(f"Unknown budget policy: {policy}")
+    if coalesce > 0:
+        group_start = None
+        for press in presses:
+            if group_start is not None and press[0] - group_start <= coalesce:
+                press[0] = group_start
+            else:
+                group_start = press[0]
+    if not max_keys_per_sec and min_repress <= 0:
+        return presses, 0, 0
+
+    accepted = []
+    recent = deque()
+    last_down = {}
+    dropped = deferred = 0
+    for press in presses:
+        down_time = press[0]
+        earliest = down_time
+        physical_key = (press[1], press[2] & PLAN_EXTENDED)
+        previous = last_down.get(physical_key)
+        if min_repress > 0 and previous is not None and previous != down_time:
+            earliest = max(earliest, previous + min_repress)
+        if max_keys_per_sec:
+            while recent and recent[0] <= earliest - rate_window:
+                recent.popleft()
+            if len(recent) >= max_keys_per_sec:
+                earliest = max(earliest, recent[0] + rate_window)
+        if earliest > down_time:
+            if policy == 'drop' or earliest - down_time > max_defer:
+                dropped += 1
+                continue
+            press[0] = earliest
+            deferred += 1
+        if max_keys_per_sec:
+            recent.append(press[0])
+        last_down[physical_key] = press[0]
+        accepted.append(press)
+    if deferred:
+        accepted.sort(key=lambda press: press[0])
+    return accepted, dropped, deferred
+
+
+def schedule_releases(presses, hold, hold_until_note_off):
+    """Turn [down_time, scancode, flags, note_off_time] presses into sorted (times, scancodes, flags) columns.
+
+    Each key is released hold seconds after it is pressed, or at its note_off
+    (but never sooner than hold) in note_off mode. A key pressed again while
+    still held is released at the re-press instead.
+    """
+    events = []
+    last_press = {}
+    for press in presses:
+        down_time, scancode, flags, off_time = press
+        if hold_until_note_off and off_time is not None:
+            press[3] = max(off_time, down_time + hold)
+        else:
+            press[3] = down_time + hold
+        physical_key = (scancode, flags & PLAN_EXTENDED)
+        previous = last_press.get(physical_key)
+        if previous is not None and previous[3] > down_time:
+            if previous[0] == down_time:
+                # Two notes landed on one key at once, keep a single longer press
+                previous[3] = max(previous[3], press[3])
+                continue
+            previous[3] = down_time
+        last_press[physical_key] = press
+        events.append(press)
+    # Interleave key-down/key-up columns, then reorder all columns by one stable index sort
+    count = len(events) * 2
+    times = array('d', bytes(8 * count))
+    scancodes = array('B', bytes(count))
+    flags = array('B', bytes(count))
+    times[0::2] = array('d', [press[0] for press in events])
+    times[1::2] = array('d', [press[3] for press in events])
+    scancodes[0::2] = scancodes[1::2] = array('B', [press[1] for press in events])
+    flags[0::2] = array('B', [press[2] for press in events])
+    flags[1::2] = array('B', [press[2] | PLAN_KEYUP for press in events])
+    order = sorted(range(count), key=times.__getitem__)
+    return (array('d', [times[i] for i in order]), array('B', [scancodes[i] for i in order]),
+            array('B', [flags[i] for i in order]))
+
+
+def compile_midi(source, keymap, range_mode, options=None, speed_multiplier=1.0, excluded_tracks=(),
+                 excluded_channels=()):
+    """Compile a MIDI file into a PlaybackPlan for the given keymap.
+
+    source is a file path, streamed once, or a MidiParts already decoded
+    from one; notes of excluded_tracks and excluded_channels (zero-based)
+    are left out before ranges are computed. keymap is a CompiledKeymap, as
+    returned by MidiPlayer.get_current_keymap(), or a plain {note: key
+    string} dict. options overrides DEFAULT_KEYMAP_OPTIONS; the hold and
+    input budget options are wall-clock, so they are scaled here.
+    """
+    if not isinstance(keymap, CompiledKeymap):
+        keymap = CompiledKeymap(None, keymap)
+    options = {**DEFAULT_KEYMAP_OPTIONS, **(options or {})}
+    hold = options['hold_ms'] / 1000 * speed_multiplier
+    hold_until_note_off = options['hold_until_note_off']
+    parts = source if isinstance(source, MidiParts) else MidiParts(source)
+    filepath = parts.filepath
+    times, channels, notes, velocities = parts.select(excluded_tracks, excluded_channels)
+    # The histogram of played notes is needed before notes can be mapped
+    histogram = [0] * 128
+    for note in compress(notes, velocities):
+        histogram[note] += 1
+    played = [note for note in range(128) if histogram[note]]
+    if not played:
+        return PlaybackPlan(filepath, array('d'), array('B'), array('B'), parts.length, None, range_mode)
+
+    note_range = (played[0], played[-1])
+    old_min, old_max = note_range
+    transpose = 0
+    # Mode 6: Find optimal range to get most keys
+    if range_mode == 6:
+        old_min, old_max = find_optimal_range(histogram, keymap.min_note, keymap.max_note)
+    # Mode 7: Transpose so the most notes land on keys
+    elif range_mode == 7:
+        transpose = find_best_transposition(histogram, keymap.notes, options['fold_octaves'])
+    note_table = build_note_table(keymap, range_mode, old_min, old_max, transpose, options['fold_octaves'])
+    plan_keys = {keymap[note]: keymap.plan_keys[note] for note in keymap}
+    press_table = tuple(DISCARD if key is DISCARD else plan_keys[key] for key in note_table)
+
+    reduce = options['max_polyphony'] or (options['reduce_density'] and options['max_keys_per_sec'])
+    presses = []
+    voice_notes = array('B')
+    voice_velocities = array('B')
+    sounding = {}
+    for event_time, channel, note, velocity in zip(times, channels, notes, velocities):
+        if not velocity:
+            pending = sounding.get((channel, note))
+            if pending:
+                pending.pop(0)[3] = event_time
+            continue
+        parsed = press_table[note]
+        if parsed is None:
+            continue
+        press = [event_time, parsed[0], parsed[1], None]
+        presses.append(press)
+        sounding.setdefault((channel, note), []).append(press)
+        if reduce:
+            voice_notes.append(note)
+            voice_velocities.append(velocity)
+    reduced = 0
+    if reduce:
+        presses, reduced = reduce_polyphony(
+            presses, voice_notes, voice_velocities, options['max_polyphony'],
+            options['max_keys_per_sec'] if options['reduce_density'] else 0,
+            max(CHORD_WINDOW_MS, options['coalesce_ms']) / 1000 * speed_multiplier, speed_multiplier)
+    presses, dropped, deferred = apply_input_budget(
+        presses, options['max_keys_per_sec'], options['min_repress_ms'] / 1000 * speed_multiplier,
+        options['coalesce_ms'] / 1000 * speed_multiplier, options['budget_policy'],
+        MAX_DEFER_MS / 1000 * speed_multiplier, speed_multiplier)
+    times, scancodes, flags = schedule_releases(presses, hold, hold_until_note_off)
+    return PlaybackPlan(filepath, times, scancodes, flags, parts.length, note_range, range_mode, dropped, deferred,
+                        sum(histogram), transpose, reduced)
@@ -2,43 +2,56 @@ import os
 import sys
 import time
 import json
-import ctypes
-from mido import MidiFile
+import atexit
+from array import array
+from bisect import bisect_left
+from collections import namedtuple, OrderedDict
+from keycodes import PLAN_KEYUP, CompiledKeymap, parse_key
+from keyoutput import OutputBackend, create_backend, build_batches, release_sequence, modifier_sequence
+from midicache import MidiMetadataCache, histogram_list, summarize_parts
+from midistream import MidiParts, PERCUSSION_CHANNEL
+from settingsstore import DebouncedWriter
+from librarywatch import LibraryWatcher, REMOVED
+from compatibility import KeymapCompatibility
+from midicompiler import (
+    compile_midi, scale_note, get_nearest_key, find_optimal_range, DEFAULT_KEYMAP_OPTIONS, RANGE_MODES
+)
+from scheduler import (
+    PlaybackClock, PlaybackProgress, LatencyRecorder, high_resolution_timer, DEFAULT_SPIN_BUDGET_MS
+)
 
-SCANCODE_MAP = {
-    'a': 0x1E, 'b': 0x30, 'c': 0x2E, 'd': 0x20, 'e': 0x12, 'f': 0x21,
-    'g': 0x22, 'h': 0x23, 'i': 0x17, 'j': 0x24, 'k': 0x25, 'l': 0x26,
-    'm': 0x32, 'n': 0x31, 'o': 0x18, 'p': 0x19, 'q': 0x10, 'r': 0x13,
-    's': 0x1F, 't': 0x14, 'u': 0x16, 'v': 0x2F, 'w': 0x11, 'x': 0x2D,
-    'y': 0x15, 'z': 0x2C,
-    '0': 0x0B, '1': 0x02, '2': 0x03, '3': 0x04, '4': 0x05, '5': 0x06,
-    '6': 0x07, '7': 0x08, '8': 0x09, '9': 0x0A,
-    'space': 0x39, 'enter': 0x1C, 'tab': 0x0F, 'backspace': 0x0E,
-    'escape': 0x01, 'delete': 0xE053, 'insert': 0xE052,
-    'up': 0xE048, 'down': 0xE050, 'left': 0xE04B, 'right': 0xE04D,
-    'home': 0xE047, 'end': 0xE04F, 'pageup': 0xE049, 'pagedown': 0xE051,
-    'f1': 0x3B, 'f2': 0x3C, 'f3': 0x3D, 'f4': 0x3E, 'f5': 0x3F,
-    'f6': 0x40, 'f7': 0x41, 'f8': 0x42, 'f9': 0x43, 'f10': 0x44,
-    'f11': 0x57, 'f12': 0x58,
-}
+# How often a paused playback loop checks for resume, seek or stop
+PAUSE_POLL_SECONDS = 0.01
+# Decoded files kept in memory, so changing tracks or channels recompiles without re-reading
+PARTS_CACHE_SIZE = 3
 
-MODIFIER_SCANCODES = {
-    'shift': 0x2A,
-    'ctrl': 0x1D,
-    'alt': 0x38
-}
-
-KEYEVENTF_KEYUP = 0x0002
-KEYEVENTF_SCANCODE = 0x0008
-KEYEVENTF_EXTENDEDKEY = 0x0001
+PreparedPlayback = namedtuple('PreparedPlayback', ['batches', 'release', 'batch_sizes', 'batch_times',
+                                                   'modifier_states', 'batch_notes', 'notes_dropped'])
 
 class MidiPlayer:
-    def __init__(self, keymap_file='keymap.json', settings_file='settings.json'):
+    def __init__(self, keymap_file='keymap.json', settings_file='settings.json', cache_file='midi_cache.json',
+                 output_backend=None):
         self.keymap_file = keymap_file
         self.settings_file = settings_file
         self.keymaps = {}
+        self.compiled_keymaps = {}
+        self.keymap_errors = {}
         self.settings = {}
         self.stop_playback = False
+        self.pause_requested = False
+        self.seek_request = None
+        self.playback_length = 0.0
+        self.progress = PlaybackProgress()
+        self.last_report = None
+        self._clock = None
+        self._prepared = None
+        self._parts = OrderedDict()
+        self._output = None
+        self.library_watcher = None
+        self.set_output_backend(output_backend)
+        self.metadata_cache = MidiMetadataCache(cache_file)
+        self._settings_writer = DebouncedWriter(settings_file)
+        atexit.register(self._settings_writer.flush)
         self._load_files()
 
     def resource_path(self,relative_path):
@@ -48,6 +61,12 @@ class MidiPlayer:
     
     def _load_files(self):
         self.keymaps = self._load_keymaps()
+        self.compiled_keymaps = {name: CompiledKeymap(name, mapping) for name, mapping in self.keymaps.items()}
+        self.keymap_compatibility = KeymapCompatibility(self.compiled_keymaps)
+        self.keymap_errors = {name: keymap.errors for name, keymap in self.compiled_keymaps.items() if keymap.errors}
+        for name, errors in self.keymap_errors.items():
+            for error in errors:
+                print(f"Warning: keymap '{name}': {error}")
         self.settings = self._load_settings()
     
     def _load_keymaps(self):
@@ -69,7 +88,14 @@ class MidiPlayer:
             "midi_directories": [os.path.expanduser("~/Music")],
             "selected_language": "en",
             "window_topmost": True,
-            "countdown_duration": 3
+            "countdown_duration": 3,
+            "library_sort": "name",
+            "excluded_channels": [PERCUSSION_CHANNEL],
+            "part_selection": {},
+            "spin_budget_ms": DEFAULT_SPIN_BUDGET_MS,
+            "keymap_options": {},
+            "output_backend": "auto",
+            "playback_report_file": "playback_report.json"
         }
         try:
             with open(self.settings_file, 'r') as f:
@@ -82,11 +108,17 @@ class MidiPlayer:
             return default_settings
     
     def save_settings(self):
+        """Queue the settings for a debounced, atomic background write; see flush_settings()."""
         try:
-            with open(self.settings_file, 'w') as f:
-                json.dump(self.settings, f, indent=4)
+            text = json.dumps(self.settings, indent=4)
         except Exception as e:
             print(f"Error saving settings: {e}")
+            return
+        self._settings_writer.write(text)
+    
+    def flush_settings(self):
+        """Write pending settings now, e.g. before exiting."""
+        self._settings_writer.flush()
     
     def get_keymaps_list(self):
         return list(self.keymaps.keys())
@@ -100,25 +132,39 @@ class MidiPlayer:
     
     def get_current_keymap(self):
         keymap_name = self.settings.get("selected_keymap")
-        if keymap_name and keymap_name in self.keymaps:
-            return {int(k): v for k, v in self.keymaps[keymap_name].items()}
+        if keymap_name and keymap_name in self.compiled_keymaps:
+            return self.compiled_keymaps[keymap_name]
         return None
     
     def get_keymap_name(self):
         return self.settings.get("selected_keymap")
     
+    def get_keymap_options(self, keymap_name=None):
+        keymap_name = keymap_name or self.get_keymap_name()
+        overrides = self.settings.get("keymap_options", {}).get(keymap_name, {})
+        return {**DEFAULT_KEYMAP_OPTIONS, **overrides}
+    
+    def set_keymap_options(self, keymap_name, **options):
+        if keymap_name not in self.keymaps or not set(options) <= set(DEFAULT_KEYMAP_OPTIONS):
+            return False
+        self.settings.setdefault("keymap_options", {}).setdefault(keymap_name, {}).update(options)
+        self.save_settings()
+        return True
+    
     def add_midi_directory(self, directory):
         if not os.path.isdir(directory):
             return False
         if directory not in self.settings["midi_directories"]:
             self.settings["midi_directories"].append(directory)
             self.save_settings()
+            self._update_library_watch()
         return True
     
     def remove_midi_directory(self, directory):
         if directory in self.settings["midi_directories"]:
             self.settings["midi_directories"].remove(directory)
             self.save_settings()
+            self._update_library_watch()
             return True
         return False
     
@@ -129,6 +175,34 @@ class MidiPlayer:
         dirs = self.get_midi_directories()
         return dirs[0] if dirs else os.path.expanduser("~/Music")
     
+    def start_library_watch(self, on_changes):
+        """Watch the MIDI directories; on_changes(changes) is called from the watcher thread.
+
+        changes is a list of (ADDED | REMOVED | MODIFIED, filepath) as applied
+        by apply_library_changes().
+        """
+        self.stop_library_watch()
+        self.library_watcher = LibraryWatcher(self.get_midi_directories(),
+                                              lambda changes: on_changes(self.apply_library_changes(changes)))
+        self.library_watcher.start()
+    
+    def stop_library_watch(self):
+        if self.library_watcher is not None:
+            self.library_watcher.stop()
+            self.library_watcher = None
+    
+    def _update_library_watch(self):
+        if self.library_watcher is not None:
+            self.library_watcher.set_directories(self.get_midi_directories())
+    
+    def apply_library_changes(self, changes):
+        """Drop cached metadata for removed files; modified files are re-analysed on next lookup."""
+        for kind, filepath in changes:
+            if kind == REMOVED:
+                self.metadata_cache.discard(filepath)
+        self.metadata_cache.save()
+        return changes
+    
     def set_playback_speed(self, speed_multiplier=None, target_duration=None):
         if speed_multiplier is not None and speed_multiplier > 0:
             self.settings["speed_multiplier"] = speed_multiplier
@@ -145,7 +219,7 @@ class MidiPlayer:
         }
     
     def set_range_mismatch_handling(self, mode):
-        if mode in (1, 2, 3, 4, 5, 6):
+        if mode in RANGE_MODES:
             self.settings["range_mismatch_handling"] = mode
             self.save_settings()
             return True
@@ -155,78 +229,90 @@ class MidiPlayer:
         return self.settings.get("range_mismatch_handling", 1)
     
     def list_midi_files(self):
-        files = []
+        return [filename for filename, _ in self.list_midi_paths()]
+    
+    def list_midi_paths(self):
+        """Return sorted (filename, filepath) pairs, first directory wins on duplicate names."""
+        paths = {}
         for directory in self.get_midi_directories():
             if not os.path.isdir(directory):
                 continue
             for f in os.listdir(directory):
-                if f.lower().endswith((".mid", ".midi")) and f not in files:
-                    files.append(f)
-        return sorted(files)
+                if f.lower().endswith((".mid", ".midi")) and f not in paths:
+                    paths[f] = os.path.join(directory, f)
+        return sorted(paths.items())
     
     def parse_and_press_key(self, key_string):
-        parts = key_string.lower().split('+')
-        modifiers = []
-        main_key = None
-        
-        for part in parts:
-            part = part.strip()
-            if part in MODIFIER_SCANCODES:
-                modifiers.append(part)
-            else:
-                main_key = part
-        
-        if not main_key or main_key not in SCANCODE_MAP:
+        parsed = parse_key(key_string)
+        if parsed is None:
             return False
-        
-        scancode = SCANCODE_MAP[main_key]
-        is_extended = scancode > 0xFF
-        
-        for mod in modifiers:
-            mod_scancode = MODIFIER_SCANCODES[mod]
-            ctypes.windll.user32.keybd_event(0, mod_scancode, KEYEVENTF_SCANCODE, 0)
-        
-        flags = KEYEVENTF_SCANCODE
-        if is_extended:
-            flags |= KEYEVENTF_EXTENDEDKEY
-            scancode = scancode & 0xFF
-        
-        ctypes.windll.user32.keybd_event(0, scancode, flags, 0)
-        time.sleep(0.01)
-        ctypes.windll.user32.keybd_event(0, scancode, flags | KEYEVENTF_KEYUP, 0)
-        
-        for mod in reversed(modifiers):
-            mod_scancode = MODIFIER_SCANCODES[mod]
-            ctypes.windll.user32.keybd_event(0, mod_scancode, KEYEVENTF_SCANCODE | KEYEVENTF_KEYUP, 0)
-        
+        self.press_key(*parsed)
         return True
     
+    def press_key(self, scancode, flags):
+        self.output.press_chord(((scancode, flags),), self.get_keymap_options()['hold_ms'] / 1000)
+    
+    @property
+    def output(self):
+        if self._output is None:
+            self._output = create_backend(self._output_name or self.settings.get("output_backend", "auto"))
+        return self._output
+    
+    def set_output_backend(self, backend):
+        """Use a backend instance or name; None falls back to the output_backend setting."""
+        if isinstance(backend, OutputBackend):
+            self._output_name = backend.name
+            self._output = backend
+        else:
+            self._output_name = backend
+            self._output = None
+    
+    def find_midi_path(self, filename):
+        for directory in self.get_midi_directories():
+            path = os.path.join(directory, filename)
+            if os.path.exists(path):
+                return path
+        return None
+    
     def get_midi_info(self, filename):
-        try:
-            for directory in self.get_midi_directories():
-                filepath = os.path.join(directory, filename)
-                if os.path.exists(filepath):
-                    midi = MidiFile(filepath)
-                    notes = []
-                    for track in midi.tracks:
-                        for msg in track:
-                            if msg.type == 'note_on' and hasattr(msg, 'note') and 0 <= msg.note <= 127:
-                                notes.append(msg.note)
-                    return {
-                        'filename': filename,
-                        'duration': midi.length,
-                        'note_range': (min(notes), max(notes)) if notes else None,
-                        'has_notes': len(notes) > 0
-                    }
+        filepath = self.find_midi_path(filename)
+        if not filepath:
             return {'filename': filename, 'error': 'File not found'}
+        try:
+            entry = self.metadata_cache.get(filepath)
         except Exception as e:
             return {'filename': filename, 'error': str(e)}
+        return self.midi_info_from_entry(filename, entry, self.get_part_selection(filename))
+    
+    @staticmethod
+    def midi_info_from_entry(filename, entry, selection=((), ())):
+        """Info dict for a cache entry.
+
+        The histogram, note_range and event_count only count the parts outside
+        selection, an (excluded_tracks, excluded_channels) pair as returned by
+        get_part_selection().
+        """
+        if 'error' in entry:
+            return {'filename': filename, 'error': entry['error']}
+        histogram = histogram_list(entry, *selection)
+        played = [note for note in range(128) if histogram[note]]
+        return {
+            'filename': filename,
+            'duration': entry['duration'],
+            'note_range': (played[0], played[-1]) if played else None,
+            'has_notes': bool(played),
+            'histogram': histogram,
+            'event_count': sum(histogram)
+        }
+    
+    def save_metadata_cache(self):
+        self.metadata_cache.save()
     
     def get_keymap_range(self):
         keymap = self.get_current_keymap()
         if not keymap:
             return None
-        return (min(keymap.keys()), max(keymap.keys()))
+        return (keymap.min_note, keymap.max_note)
     
     def check_midi_range(self, filename):
         keymap = self.get_current_keymap()
@@ -241,150 +327,371 @@ class MidiPlayer:
             return 'compatible'
         return {'status': 'mismatch', 'keymap_range': (min_key, max_key), 'midi_range': (min_note, max_note)}
     
-    @staticmethod
-    def scale_note(note, old_min, old_max, new_min, new_max):
-        if old_max == old_min:
-            return new_min
-        scaled = (note - old_min) * (new_max - new_min) / (old_max - old_min) + new_min
-        return int(round(scaled))
+    def score_midi_info(self, info):
+        """Add the file's keymap compatibility row to a get_midi_info() dict.
+
+        Sets 'keymap_scores' (a CompatibilityScore per keymap, in
+        keymap_compatibility.names order, or None without notes) and
+        'best_keymap'. Uses only the histogram, so no file is read.
+        """
+        if 'error' in info:
+            return info
+        row = self.keymap_compatibility.scores(info['histogram'])
+        column = self.keymap_compatibility.best(row)
+        info['keymap_scores'] = row
+        info['best_keymap'] = None if column is None else self.keymap_compatibility.names[column]
+        return info
     
-    @staticmethod
-    def get_nearest_key(note, note_to_key):
-        return note_to_key[min(note_to_key.keys(), key=lambda x: abs(x - note))]
+    def get_compatibility(self, filename):
+        """Return {keymap_name: CompatibilityScore(coverage, playable_ratio)} for every keymap, or None."""
+        info = self.score_midi_info(self.get_midi_info(filename))
+        if not info.get('keymap_scores'):
+            return None
+        return dict(zip(self.keymap_compatibility.names, info['keymap_scores']))
     
-    @staticmethod
-    def _find_optimal_range(notes, min_key, max_key):
-        """Find the range in MIDI notes that maps to the most keymap keys."""
-        if not notes:
-            return 0, 127
-        
-        unique_notes = sorted(set(notes))
-        best_range = (unique_notes[0], unique_notes[-1])
-        best_count = 0
-        
-        for i, start_note in enumerate(unique_notes):
-            for end_note in unique_notes[i:]:
-                count = len([n for n in unique_notes if start_note <= n <= end_note])
-                if count > best_count:
-                    best_count = count
-                    best_range = (start_note, end_note)
-        
-        return best_range
+    def get_best_keymap(self, filename):
+        """Name of the keymap that plays the most of the file's notes as written, or None."""
+        return self.score_midi_info(self.get_midi_info(filename)).get('best_keymap')
+    
+    def get_part_selection(self, filename):
+        """Zero-based (excluded_tracks, excluded_channels) of a file, or the default excluded_channels."""
+        selection = self.settings.get("part_selection", {}).get(filename)
+        if selection is None:
+            return frozenset(), frozenset(self.settings.get("excluded_channels", []))
+        return frozenset(selection["excluded_tracks"]), frozenset(selection["excluded_channels"])
+    
+    def set_part_selection(self, filename, excluded_tracks=None, excluded_channels=None):
+        """Choose which tracks and channels of a file play; None keeps the current value."""
+        tracks, channels = self.get_part_selection(filename)
+        self.settings.setdefault("part_selection", {})[filename] = {
+            "excluded_tracks": sorted(tracks if excluded_tracks is None else excluded_tracks),
+            "excluded_channels": sorted(channels if excluded_channels is None else excluded_channels)
+        }
+        self.save_settings()
+    
+    def set_track_included(self, filename, track, included):
+        tracks = self.get_part_selection(filename)[0]
+        self.set_part_selection(filename, excluded_tracks=tracks - {track} if included else tracks | {track})
+    
+    def set_channel_included(self, filename, channel, included):
+        channels = self.get_part_selection(filename)[1]
+        self.set_part_selection(filename, excluded_channels=channels - {channel} if included else channels | {channel})
+    
+    def reset_part_selection(self, filename):
+        """Go back to the default excluded_channels for a file."""
+        if self.settings.get("part_selection", {}).pop(filename, None) is not None:
+            self.save_settings()
+    
+    def get_part_stats(self, filename):
+        """Per-track and per-channel note stats of a file from the metadata cache, or None.
+
+        Returns {'tracks': [...], 'channels': [...]}; see summarize_parts()
+        for the fields. Track stats add 'name' and every stat 'included',
+        from get_part_selection().
+        """
+        filepath = self.find_midi_path(filename)
+        if not filepath:
+            return None
+        try:
+            entry = self.metadata_cache.get(filepath)
+        except Exception:
+            return None
+        if 'error' in entry:
+            return None
+        excluded_tracks, excluded_channels = self.get_part_selection(filename)
+        tracks = summarize_parts(entry, 'track')
+        for stats in tracks:
+            stats['name'] = entry['track_names'].get(str(stats['track']))
+            stats['included'] = stats['track'] not in excluded_tracks
+        channels = summarize_parts(entry, 'channel')
+        for stats in channels:
+            stats['included'] = stats['channel'] not in excluded_channels
+        return {'tracks': tracks, 'channels': channels}
+    
+    def load_parts(self, filepath):
+        """Decoded MidiParts of a file, reused while the file is unchanged for the last few files."""
+        signature = self.metadata_cache.file_signature(filepath)
+        cached = self._parts.get(filepath)
+        if cached is not None and cached[0] == signature:
+            self._parts.move_to_end(filepath)
+            return cached[1]
+        parts = MidiParts(filepath)
+        self._parts[filepath] = (signature, parts)
+        while len(self._parts) > PARTS_CACHE_SIZE:
+            self._parts.popitem(last=False)
+        return parts
+    
+    scale_note = staticmethod(scale_note)
+    get_nearest_key = staticmethod(get_nearest_key)
+    _find_optimal_range = staticmethod(find_optimal_range)
+    
+    def compile_plan(self, filename, range_mode=None, speed_multiplier=None):
+        """Compile a MIDI file with the current keymap into a PlaybackPlan."""
+        keymap = self.get_current_keymap()
+        filepath = self.find_midi_path(filename)
+        if not keymap or not filepath:
+            return None
+        if range_mode is None:
+            range_mode = self.get_range_mismatch_handling()
+        if speed_multiplier is None:
+            speed_multiplier = self.get_effective_speed(self.get_midi_info(filename).get('duration'))
+        return compile_midi(self.load_parts(filepath), keymap, range_mode, self.get_keymap_options(), speed_multiplier,
+                            *self.get_part_selection(filename))
     
-    def play_midi(self, filename, on_progress=None, on_status=None):
+    def play_midi(self, filename, on_progress=None, on_status=None, start_time=0.0, countdown=None):
+        """Play a file from start_time (file seconds). Returns a PlaybackReport, or False if playback never started.
+
+        Pause, resume and seek requests from other threads are served inside
+        the loop; the compiled plan is kept, so replaying the same file with
+        unchanged settings skips compilation.
+        """
         self.stop_playback = False
+        self.pause_requested = False
+        self.seek_request = None
         keymap = self.get_current_keymap()
         if not keymap:
             if on_status:
                 on_status("No keymap selected")
             return False
-        filepath = None
-        for directory in self.get_midi_directories():
-            path = os.path.join(directory, filename)
-            if os.path.exists(path):
-                filepath = path
-                break
+        filepath = self.find_midi_path(filename)
         if not filepath:
             if on_status:
                 on_status("MIDI file not found")
             return False
-        try:
-            midi = MidiFile(filepath)
-        except Exception as e:
-            if on_status:
-                on_status(f"Error loading MIDI: {e}")
-            return False
-        range_check = self.check_midi_range(filename)
-        if range_check == 'no_notes':
-            if on_status:
-                on_status("No notes found")
-            return False
         range_mode = self.get_range_mismatch_handling()
-        speed_multiplier = self.settings.get("speed_multiplier", 1.0)
-        target_duration = self.settings.get("target_duration")
-        if target_duration is not None and target_duration > 0:
-            speed_multiplier = midi.length / target_duration
-        old_notes = []
-        for track in midi.tracks:
-            for msg in track:
-                if msg.type == 'note_on' and hasattr(msg, 'note') and 0 <= msg.note <= 127:
-                    old_notes.append(msg.note)
-        old_min = min(old_notes) if old_notes else 0
-        old_max = max(old_notes) if old_notes else 0
-        min_key, max_key = self.get_keymap_range()
+        speed_multiplier = self.get_effective_speed(self.get_midi_info(filename).get('duration'))
+        selection = self.get_part_selection(filename)
         
-        # Mode 6: Find optimal range to get most keys
-        if range_mode == 6:
-            old_min, old_max = self._find_optimal_range(old_notes, min_key, max_key)
-        
-        countdown = self.settings.get("countdown_duration", 3)
-        if countdown > 0:
-            for i in range(countdown, 0, -1):
-                if self.stop_playback:
+        # Compile while the countdown runs so the hot loop only waits and sends
+        prepared = None
+        if countdown is None:
+            countdown = self.settings.get("countdown_duration", 3)
+        countdown_start = time.time()
+        for i in range(countdown, 0, -1):
+            if self.stop_playback:
+                return False
+            if on_status:
+                on_status(f"Starting in {i}...")
+            if prepared is None:
+                prepared = self._prepare_playback(filepath, keymap, range_mode, speed_multiplier, selection,
+                                                   on_status)
+                if prepared is None:
                     return False
-                if on_status:
-                    on_status(f"Starting in {i}...")
-                time.sleep(1)
+            tick_end = countdown_start + (countdown - i + 1)
+            remaining = tick_end - time.time()
+            if remaining > 0 and self.output.realtime:
+                time.sleep(remaining)
+        if prepared is None:
+            prepared = self._prepare_playback(filepath, keymap, range_mode, speed_multiplier, selection,
+                                              on_status)
+            if prepared is None:
+                return False
         
-        # Reload MIDI and count messages
-        midi = MidiFile(filepath)
-        all_messages = list(midi)
-        total_msgs = len(all_messages)
-        
-        time_cursor = 0.0
-        start_time = time.time()
+        batches, release, batch_sizes, batch_times, modifier_states, batch_notes, notes_dropped = prepared
+        total_batches = len(batches)
+        total_time = batch_times[-1]
+        self.playback_length = total_time
+        send = self.output.send
+        interrupted = lambda: self.stop_playback or self.pause_requested or self.seek_request is not None
+        clock = PlaybackClock(speed_multiplier, self.settings.get("spin_budget_ms", DEFAULT_SPIN_BUDGET_MS),
+                              self.output.realtime)
+        self._clock = clock
+        recorder = LatencyRecorder(total_batches, clock.realtime)
+        scheduled_ns = recorder.scheduled_ns
+        sent_ns = recorder.sent_ns
+        perf_counter_ns = time.perf_counter_ns
+        progress = self.progress
+        publish_interval_ns = progress.interval_ns
+        next_publish_ns = 0
+        callback_ns = 0
+        sent_count = 0
+        key_events = 0
+        notes_sent = 0
+        completed = False
+        progress.publish(True, False, start_time, total_time, speed_multiplier, 0, notes_dropped, 0.0)
         if on_status:
             on_status(f"Playing {filename}")
         try:
-            for msg_index, msg in enumerate(all_messages):
-                if self.stop_playback:
-                    if on_status:
-                        on_status("Stopped")
-                    return False
-                time_cursor += msg.time
-                elapsed = time.time() - start_time
-                sleep_time = time_cursor - elapsed
-                if sleep_time > 0.001:
-                    time.sleep(sleep_time / speed_multiplier)
-                if msg.type == 'note_on' and msg.velocity > 0 and hasattr(msg, 'note'):
-                    note = msg.note
-                    if not (0 <= note <= 127):
+            with high_resolution_timer():
+                clock.start()
+                batch_index = 0
+                if start_time:
+                    self.seek_request = start_time
+                while batch_index < total_batches:
+                    batch_time, inputs = batches[batch_index]
+                    deadline_ns = clock.deadline_ns(batch_time)
+                    if interrupted() or not clock.wait_until(deadline_ns, interrupted):
+                        if not self.stop_playback:
+                            batch_index = self._serve_transport(clock, batch_index, prepared, filename, on_status,
+                                                                speed_multiplier, notes_sent)
+                        if self.stop_playback:
+                            send(release)
+                            if on_status:
+                                on_status("Stopped")
+                            break
+                        next_publish_ns = 0
                         continue
-                    if range_mode == 1:
-                        scaled_note = self.scale_note(note, old_min, old_max, min_key, max_key)
-                        key = keymap.get(scaled_note, self.get_nearest_key(scaled_note, keymap))
-                    elif range_mode == 2:
-                        key = keymap.get(note, self.get_nearest_key(note, keymap))
-                    elif range_mode == 3:
-                        if note < min_key or note > max_key:
-                            continue
-                        key = keymap.get(note, self.get_nearest_key(note, keymap))
-                    elif range_mode == 4:
-                        offset = min_key - old_min
-                        mapped_note = note + offset
-                        if mapped_note > max_key:
-                            continue
-                        key = keymap.get(mapped_note, self.get_nearest_key(mapped_note, keymap))
-                    elif range_mode == 5:
-                        offset = max_key - old_max
-                        mapped_note = note + offset
-                        if mapped_note < min_key:
-                            continue
-                        key = keymap.get(mapped_note, self.get_nearest_key(mapped_note, keymap))
-                    elif range_mode == 6:
-                        scaled_note = self.scale_note(note, old_min, old_max, min_key, max_key)
-                        key = keymap.get(scaled_note, self.get_nearest_key(scaled_note, keymap))
-                    self.parse_and_press_key(key)
-                if on_progress and total_msgs > 0:
-                    progress = int((msg_index / total_msgs) * 100)
-                    on_progress(progress)
-            if on_status:
+                    send(inputs, deadline_ns)
+                    now_ns = perf_counter_ns()
+                    if sent_count < total_batches:
+                        scheduled_ns[sent_count] = deadline_ns
+                        sent_ns[sent_count] = now_ns
+                        sent_count += 1
+                    key_events += batch_sizes[batch_index]
+                    notes_sent += batch_notes[batch_index]
+                    batch_index += 1
+                    # Progress is published at a fixed rate, never per batch
+                    if now_ns >= next_publish_ns:
+                        next_publish_ns = now_ns + publish_interval_ns
+                        progress.publish(True, False, batch_time, total_time, speed_multiplier, notes_sent,
+                                         notes_dropped, (now_ns - deadline_ns) / 1e6 if clock.realtime else 0.0)
+                        if on_progress:
+                            callback_start = perf_counter_ns()
+                            on_progress(int(progress.fraction * 100))
+                            callback_ns += perf_counter_ns() - callback_start
+                else:
+                    completed = True
+            if completed and on_status:
                 on_status("Completed")
-            return True
         except Exception as e:
+            send(release)
             if on_status:
                 on_status(f"Error: {e}")
-            return False
+        self._clock = None
+        snapshot = progress.snapshot
+        progress.publish(False, False, total_time if completed else snapshot.position, total_time, speed_multiplier,
+                         notes_sent, notes_dropped, snapshot.lateness_ms)
+        recorder.count = sent_count
+        recorder.callback_ns = callback_ns
+        report = recorder.report(filename, completed, key_events)
+        self.last_report = report
+        self.save_playback_report(report)
+        return report
+    
+    def _serve_transport(self, clock, batch_index, prepared, filename, on_status, speed_multiplier, notes_sent):
+        """Apply pending pause/seek requests and return the batch index to continue from.
+
+        Every key is released first; after a seek or resume the modifiers the
+        plan holds at the next batch are pressed again so its sequence stays
+        valid. Returns with stop_playback set if playback was stopped while paused.
+        """
+        batches, release, _, batch_times, modifier_states, _, notes_dropped = prepared
+        total_time = batch_times[-1] if batch_times else 0.0
+        output = self.output
+        output.send(release)
+        while True:
+            target = self.seek_request
+            if target is not None:
+                self.seek_request = None
+                target = min(max(target, 0.0), total_time)
+                batch_index = bisect_left(batch_times, target)
+                clock.seek(target)
+            if self.stop_playback or not self.pause_requested:
+                break
+            if not clock.paused:
+                clock.pause()
+                if on_status:
+                    on_status("Paused")
+            self.progress.publish(True, True, clock.elapsed(), total_time, speed_multiplier, notes_sent,
+                                  notes_dropped, 0.0)
+            time.sleep(PAUSE_POLL_SECONDS)
+        if self.stop_playback:
+            return batch_index
+        if clock.paused:
+            clock.resume()
+            if on_status:
+                on_status(f"Playing {filename}")
+        if batch_index < len(batches) and modifier_states[batch_index]:
+            output.send(output.prepare(modifier_sequence(modifier_states[batch_index])))
+        return batch_index
+    
+    def pause_playback(self):
+        self.pause_requested = True
+    
+    def resume_playback(self):
+        self.pause_requested = False
+    
+    def seek_playback(self, position):
+        """Jump the running playback to position (file seconds); works while paused too."""
+        self.seek_request = max(position, 0.0)
+    
+    def get_playback_position(self):
+        """Current position in file seconds, or None when nothing is playing."""
+        clock = self._clock
+        if clock is None or clock.start_ns is None:
+            return None
+        return min(max(clock.elapsed(), 0.0), self.playback_length)
+    
+    @property
+    def is_paused(self):
+        return self.pause_requested
+    
+    def save_playback_report(self, report):
+        report_file = self.settings.get("playback_report_file")
+        if not report_file:
+            return
+        try:
+            report.save(report_file)
+        except Exception as e:
+            print(f"Error saving playback report: {e}")
+    
+    def get_effective_speed(self, duration=None):
+        speed_multiplier = self.settings.get("speed_multiplier", 1.0)
+        target_duration = self.settings.get("target_duration")
+        if target_duration is not None and target_duration > 0 and duration:
+            speed_multiplier = duration / target_duration
+        return speed_multiplier
+    
+    def _prepare_playback(self, filepath, keymap, range_mode, speed_multiplier, selection, on_status):
+        try:
+            # The backend is created on first use, which fails without e.g. libXtst or an X display
+            output = self.output
+        except Exception as e:
+            if on_status:
+                on_status(f"Error: {e}")
+            return None
+        options = self.get_keymap_options()
+        try:
+            signature = self.metadata_cache.file_signature(filepath)
+        except OSError:
+            signature = None
+        cache_key = (filepath, signature, keymap.name, range_mode, speed_multiplier,
+                     tuple(sorted(options.items())), selection, id(output))
+        if self._prepared is not None and self._prepared[0] == cache_key:
+            return self._prepared[1]
+        try:
+            plan = compile_midi(self.load_parts(filepath), keymap, range_mode, options, speed_multiplier, *selection)
+        except Exception as e:
+            if on_status:
+                on_status(f"Error loading MIDI: {e}")
+            return None
+        if not plan.has_notes:
+            if on_status:
+                on_status("No notes found")
+            return None
+        if not len(plan):
+            # The range mode or track selection left nothing to press
+            if on_status:
+                on_status("No playable notes")
+            return None
+        notes_at = {}
+        for event_time, _, flags in plan:
+            if not flags & PLAN_KEYUP:
+                notes_at[event_time] = notes_at.get(event_time, 0) + 1
+        batches = []
+        batch_sizes = array('I')
+        batch_times = array('d')
+        batch_notes = array('I')
+        modifier_states = []
+        for batch_time, sequence in build_batches(plan, modifier_states):
+            batches.append((batch_time, output.prepare(sequence)))
+            batch_sizes.append(len(sequence))
+            batch_times.append(batch_time)
+            batch_notes.append(notes_at.get(batch_time, 0))
+        prepared = PreparedPlayback(batches, output.prepare(release_sequence(plan)), batch_sizes,
+                                    batch_times, modifier_states, batch_notes, plan.notes_dropped)
+        self._prepared = (cache_key, prepared)
+        return prepared
     
     def test_keymap(self, on_progress=None, on_status=None):
         self.stop_playback = False
@@ -393,7 +700,7 @@ class MidiPlayer:
             if on_status:
                 on_status("No keymap")
             return False
-        test_notes = sorted(keymap.keys())
+        test_notes = keymap.notes
         if on_status:
             on_status(f"Testing {self.get_keymap_name()}")
         try:
@@ -405,8 +712,9 @@ class MidiPlayer:
                 key = keymap[note]
                 if on_status:
                     on_status(f"Note {note} -> {key}")
-                self.parse_and_press_key(key)
-                time.sleep(0.25)
+                self.press_key(*keymap.plan_keys[note])
+                if self.output.realtime:
+                    time.sleep(0.25)
                 if on_progress:
                     progress = int(((index + 1) / len(test_notes)) * 100)
                     on_progress(progress, 100)
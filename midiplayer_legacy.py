@@ -6,37 +6,15 @@ import json
 import win32gui
 import win32con
 import threading
-from mido import MidiFile
+from keycodes import CompiledKeymap
+from keyoutput import SendInputBackend, build_batches, release_sequence
+from midicache import MidiMetadataCache
+from midicompiler import compile_midi
+from scheduler import PlaybackClock, high_resolution_timer, DEFAULT_SPIN_BUDGET_MS
+from settingsstore import atomic_write_text
 from colorama import Fore, Style, init
 init(autoreset=True)
 
-SCANCODE_MAP = {
-    'a': 0x1E, 'b': 0x30, 'c': 0x2E, 'd': 0x20, 'e': 0x12, 'f': 0x21,
-    'g': 0x22, 'h': 0x23, 'i': 0x17, 'j': 0x24, 'k': 0x25, 'l': 0x26,
-    'm': 0x32, 'n': 0x31, 'o': 0x18, 'p': 0x19, 'q': 0x10, 'r': 0x13,
-    's': 0x1F, 't': 0x14, 'u': 0x16, 'v': 0x2F, 'w': 0x11, 'x': 0x2D,
-    'y': 0x15, 'z': 0x2C,
-    '0': 0x0B, '1': 0x02, '2': 0x03, '3': 0x04, '4': 0x05, '5': 0x06,
-    '6': 0x07, '7': 0x08, '8': 0x09, '9': 0x0A,
-    'space': 0x39, 'enter': 0x1C, 'tab': 0x0F, 'backspace': 0x0E,
-    'escape': 0x01, 'delete': 0xE053, 'insert': 0xE052,
-    'up': 0xE048, 'down': 0xE050, 'left': 0xE04B, 'right': 0xE04D,
-    'home': 0xE047, 'end': 0xE04F, 'pageup': 0xE049, 'pagedown': 0xE051,
-    'f1': 0x3B, 'f2': 0x3C, 'f3': 0x3D, 'f4': 0x3E, 'f5': 0x3F,
-    'f6': 0x40, 'f7': 0x41, 'f8': 0x42, 'f9': 0x43, 'f10': 0x44,
-    'f11': 0x57, 'f12': 0x58,
-}
-
-MODIFIER_SCANCODES = {
-    'shift': 0x2A,
-    'ctrl': 0x1D,
-    'alt': 0x38
-}
-
-KEYEVENTF_KEYUP = 0x0002
-KEYEVENTF_SCANCODE = 0x0008
-KEYEVENTF_EXTENDEDKEY = 0x0001
-
 def run_as_admin():
     if ctypes.windll.shell32.IsUserAnAdmin():
         return True
@@ -61,43 +39,12 @@ def set_console_topmost():
     else:
         print("Cannot find console window handle")
 
-def parse_and_press_key(key_string):
-    parts = key_string.lower().split('+')
-    modifiers = []
-    main_key = None
-    
-    for part in parts:
-        part = part.strip()
-        if part in MODIFIER_SCANCODES:
-            modifiers.append(part)
-        else:
-            main_key = part
-    
-    if not main_key or main_key not in SCANCODE_MAP:
-        print(f"Warning: Invalid key combination '{key_string}'")
-        return
-    
-    scancode = SCANCODE_MAP[main_key]
-    is_extended = scancode > 0xFF
-    
-    for mod in modifiers:
-        mod_scancode = MODIFIER_SCANCODES[mod]
-        ctypes.windll.user32.keybd_event(0, mod_scancode, KEYEVENTF_SCANCODE, 0)
-    
-    flags = KEYEVENTF_SCANCODE
-    if is_extended:
-        flags |= KEYEVENTF_EXTENDEDKEY
-        scancode = scancode & 0xFF
-    
-    ctypes.windll.user32.keybd_event(0, scancode, flags, 0)
-    time.sleep(0.01)
-    ctypes.windll.user32.keybd_event(0, scancode, flags | KEYEVENTF_KEYUP, 0)
-    
-    for mod in reversed(modifiers):
-        mod_scancode = MODIFIER_SCANCODES[mod]
-        ctypes.windll.user32.keybd_event(0, mod_scancode, KEYEVENTF_SCANCODE | KEYEVENTF_KEYUP, 0)
+def press_key(scancode, flags):
+    output.press_chord(((scancode, flags),))
 
 set_console_topmost()
+metadata_cache = MidiMetadataCache('midi_cache.json')
+output = SendInputBackend()
 
 def clear_console():
     os.system('cls' if os.name == 'nt' else 'clear')
@@ -106,6 +53,9 @@ def load_keymaps():
     try:
         with open('keymap.json', 'r') as f:
             keymaps = json.load(f)
+        for name, mapping in keymaps.items():
+            for error in CompiledKeymap(name, mapping).errors:
+                print(f"Warning: keymap '{name}': {error}")
         return keymaps
     except FileNotFoundError:
         print("Error: keymap.json not found!")
@@ -121,7 +71,8 @@ def load_settings():
         "range_mismatch_handling": 1,
         "speed_multiplier": 1.0,
         "target_duration": None,
-        "midi_directories": ["D:/Files/Audio/mid"]
+        "midi_directories": ["D:/Files/Audio/mid"],
+        "spin_budget_ms": DEFAULT_SPIN_BUDGET_MS
     }
     try:
         with open('settings.json', 'r') as f:
@@ -135,8 +86,7 @@ def load_settings():
 
 def save_settings(settings):
     try:
-        with open('settings.json', 'w') as f:
-            json.dump(settings, f, indent=4)
+        atomic_write_text('settings.json', json.dumps(settings, indent=4))
     except Exception as e:
         print(f"Error saving settings: {e}")
 
@@ -156,7 +106,7 @@ def select_keymap(keymaps, current_keymap=None):
             choice_num = int(choice) - 1
             if 0 <= choice_num < len(keymaps):
                 selected_map_name = list(keymaps.keys())[choice_num]
-                return selected_map_name, {int(k): v for k, v in keymaps[selected_map_name].items()}
+                return selected_map_name, CompiledKeymap(selected_map_name, keymaps[selected_map_name])
             else:
                 print(f"Invalid selection. Please enter a number between 1 and {len(keymaps)}.")
         except ValueError:
@@ -169,25 +119,21 @@ def format_duration(seconds):
 
 def scan_midi_files_range(file_folder_tuples, note_to_key):
     results = []
-    min_key = min(note_to_key.keys())
-    max_key = max(note_to_key.keys())
+    min_key = note_to_key.min_note
+    max_key = note_to_key.max_note
 
     for f, folder in file_folder_tuples:
         try:
             midi_path = os.path.join(folder, f)
-            midi = MidiFile(midi_path)
-            duration = format_duration(midi.length)
-            notes = []
-            
-            for track in midi.tracks:
-                for msg in track:
-                    if msg.type == 'note_on' and hasattr(msg, 'note'):
-                        if 0 <= msg.note <= 127:
-                            notes.append(msg.note)
-
-            if not notes:
+            info = metadata_cache.get(midi_path)
+            if 'error' in info:
+                raise ValueError(info['error'])
+            duration = format_duration(info['duration'])
+            note_range = info['note_range']
+
+            if not note_range:
                 colored_name = f"{Fore.LIGHTBLACK_EX}{f}{Style.RESET_ALL} ({duration})"
-            elif min(notes) >= min_key and max(notes) <= max_key:
+            elif note_range[0] >= min_key and note_range[1] <= max_key:
                 colored_name = f"{Fore.GREEN}{f}{Style.RESET_ALL} ({duration})"
             else:
                 colored_name = f"{Fore.YELLOW}{f}{Style.RESET_ALL} ({duration})"
@@ -195,6 +141,7 @@ def scan_midi_files_range(file_folder_tuples, note_to_key):
             colored_name = f"{Fore.RED}{f}{Style.RESET_ALL} (error)"
 
         results.append((f, folder, colored_name))
+    metadata_cache.save()
     return results
 
 def list_midi_files(folders):
@@ -211,25 +158,14 @@ def list_midi_files(folders):
                 print(f"Error reading directory {folder}: {e}")
     return midi_files
 
-def get_nearest_key(note, note_to_key):
-    return note_to_key[min(note_to_key.keys(), key=lambda x: abs(x - note))]
-
-def check_midi_range(midi, note_to_key):
-    min_key = min(note_to_key.keys())
-    max_key = max(note_to_key.keys())
+def check_midi_range(note_range, note_to_key):
+    min_key = note_to_key.min_note
+    max_key = note_to_key.max_note
 
-    notes_in_midi = []
-    for track in midi.tracks:
-        for msg in track:
-            if msg.type == 'note_on' and hasattr(msg, 'note'):
-                if 0 <= msg.note <= 127:
-                    notes_in_midi.append(msg.note)
-    
-    if not notes_in_midi:
+    if not note_range:
         return None 
 
-    min_midi = min(notes_in_midi)
-    max_midi = max(notes_in_midi)
+    min_midi, max_midi = note_range
 
     if min_midi >= min_key and max_midi <= max_key:
         return 1
@@ -250,22 +186,15 @@ def check_midi_range(midi, note_to_key):
         else:
             print("Invalid choice. Please enter 1, 2, or 3.")
 
-def scale_note(note, old_min, old_max, new_min, new_max):
-    if old_max == old_min:
-        return new_min
-    scaled = (note - old_min) * (new_max - new_min) / (old_max - old_min) + new_min
-    return int(round(scaled))
-
 def play_midi(file_path, note_to_key, selected_map_name, range_choice=1, 
-              speed_multiplier=1.0, target_duration=None):
-    try:
-        midi = MidiFile(file_path)
-    except Exception as e:
-        print(f"Error loading MIDI file: {e}")
+              speed_multiplier=1.0, target_duration=None, spin_budget_ms=DEFAULT_SPIN_BUDGET_MS):
+    info = metadata_cache.get(file_path)
+    if 'error' in info:
+        print(f"Error loading MIDI file: {info['error']}")
         return
     
     if range_choice is None:
-        choice = check_midi_range(midi, note_to_key)
+        choice = check_midi_range(info['note_range'], note_to_key)
         if choice is None:
             print("No notes found in MIDI file.")
             return
@@ -273,23 +202,11 @@ def play_midi(file_path, note_to_key, selected_map_name, range_choice=1,
         choice = range_choice
 
     if target_duration is not None:
-        speed_multiplier = midi.length / target_duration
+        speed_multiplier = info['duration'] / target_duration
     
-    min_key = min(note_to_key.keys())
-    max_key = max(note_to_key.keys())
-    
-    old_notes = []
-    for track in midi.tracks:
-        for msg in track:
-            if msg.type == 'note_on' and hasattr(msg, 'note'):
-                if 0 <= msg.note <= 127:
-                    old_notes.append(msg.note)
-    
-    old_min = min(old_notes) if old_notes else 0
-    old_max = max(old_notes) if old_notes else 0
-
-    time_cursor = 0.0
-    start_time = time.time()
+    plan = compile_midi(file_path, note_to_key, choice, speed_multiplier=speed_multiplier)
+    batches = [(batch_time, output.prepare(sequence)) for batch_time, sequence in build_batches(plan)]
+    release = output.prepare(release_sequence(plan))
 
     clear_console()
     print(f"\nPlaying '{file_path}'\nusing '{selected_map_name}' mapping")
@@ -303,39 +220,22 @@ def play_midi(file_path, note_to_key, selected_map_name, range_choice=1,
     print("Press Ctrl+C to stop playback")
 
     try:
-        for msg in midi:
-            time_cursor += msg.time
-            elapsed = time.time() - start_time
-            sleep_time = time_cursor - elapsed
-            if sleep_time > 0:
-                time.sleep(sleep_time / speed_multiplier)
-
-            if msg.type == 'note_on' and msg.velocity > 0 and hasattr(msg, 'note'):
-                note = msg.note
-                
-                if not (0 <= note <= 127):
-                    continue
-                
-                if choice == 1:
-                    scaled_note = scale_note(note, old_min, old_max, min_key, max_key)
-                    key = note_to_key.get(scaled_note, get_nearest_key(scaled_note, note_to_key))
-                elif choice == 2:
-                    key = note_to_key.get(note, get_nearest_key(note, note_to_key))
-                else:
-                    if note < min_key or note > max_key:
-                        continue
-                    else:
-                        key = note_to_key.get(note, get_nearest_key(note, note_to_key))
-
-                parse_and_press_key(key)
+        clock = PlaybackClock(speed_multiplier, spin_budget_ms)
+        with high_resolution_timer():
+            clock.start()
+            for batch_time, inputs in batches:
+                clock.wait_until(clock.deadline_ns(batch_time))
+                output.send(inputs)
 
     except KeyboardInterrupt:
+        output.send(release)
         print("\nPlayback stopped by user")
     except Exception as e:
+        output.send(release)
         print(f"Error during playback: {e}")
 
 def run_test_mapping(note_to_key, selected_map_name):
-    test_notes = sorted(note_to_key.keys()) 
+    test_notes = note_to_key.notes
 
     clear_console()
     print(f"\nRunning test for mapping '{selected_map_name}'...")
@@ -346,7 +246,7 @@ def run_test_mapping(note_to_key, selected_map_name):
         for note in test_notes:
             key = note_to_key[note]
             print(f"Pressing note {note} mapped to key '{key}'")
-            parse_and_press_key(key)
+            press_key(*note_to_key.plan_keys[note])
             time.sleep(0.5)
         print("Test completed!")
     except KeyboardInterrupt:
@@ -497,7 +397,7 @@ def main():
     
     if settings["selected_keymap"] and settings["selected_keymap"] in keymaps:
         selected_map_name = settings["selected_keymap"]
-        note_to_key = {int(k): v for k, v in keymaps[selected_map_name].items()}
+        note_to_key = CompiledKeymap(selected_map_name, keymaps[selected_map_name])
     else:
         result = select_keymap(keymaps)
         if result is None:
@@ -534,7 +434,8 @@ def main():
                         play_midi(file_path, note_to_key, selected_map_name, 
                                 settings["range_mismatch_handling"], 
                                 settings["speed_multiplier"], 
-                                settings["target_duration"])
+                                settings["target_duration"],
+                                settings["spin_budget_ms"])
                 except ValueError:
                     print("Invalid input. Please enter a number or 'X'.")
         
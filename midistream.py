@@ -0,0 +1,211 @@
+import mmap
+import heapq
+from array import array
+from itertools import compress
+
+DEFAULT_TEMPO = 500000
+# General MIDI percussion (channel 10, zero-based 9); its note numbers pick drums, not pitches
+PERCUSSION_CHANNEL = 9
+CHANNEL_COUNT = 16
+
+# Event kinds yielded by the per-track decoders
+NOTE = 0
+TEMPO = 1
+TRACK_END = 2
+TRACK_NAME = 3
+
+# Data byte count per channel message status (high nibble)
+CHANNEL_DATA_LENGTH = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+
+
+def _read_varlen(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def _track_events(data, pos, end, track_index):
+    """Decode one MTrk chunk lazily into (tick, track, seq, kind, a, b, c) tuples.
+
+    Only note on/off, tempo changes and the first track name are yielded;
+    note_off is reported as velocity 0. The (tick, track, seq) prefix keeps
+    heap merging stable in track order, the same order mido uses when it
+    merges tracks.
+    """
+    tick = 0
+    seq = 0
+    status = 0
+    named = False
+    try:
+        while pos < end:
+            delta, pos = _read_varlen(data, pos)
+            tick += delta
+            byte = data[pos]
+            if byte & 0x80:
+                pos += 1
+                if byte < 0xF0:
+                    status = byte
+            elif not status:
+                raise ValueError(f"running status without a status byte at offset {pos}")
+            else:
+                byte = status
+            if byte == 0xFF:
+                meta_type = data[pos]
+                length, pos = _read_varlen(data, pos + 1)
+                if meta_type == 0x51 and length == 3:
+                    seq += 1
+                    yield tick, track_index, seq, TEMPO, (data[pos] << 16) | (data[pos + 1] << 8) | data[pos + 2], 0, 0
+                elif meta_type == 0x03 and not named:
+                    named = True
+                    seq += 1
+                    yield tick, track_index, seq, TRACK_NAME, bytes(data[pos:pos + length]), 0, 0
+                elif meta_type == 0x2F:
+                    break
+                pos += length
+            elif byte == 0xF0 or byte == 0xF7:
+                length, pos = _read_varlen(data, pos)
+                pos += length
+            elif byte >= 0xF0:
+                raise ValueError(f"unexpected status byte 0x{byte:02X} at offset {pos - 1}")
+            else:
+                kind = byte & 0xF0
+                if kind == 0x90 or kind == 0x80:
+                    note = data[pos]
+                    velocity = data[pos + 1] if kind == 0x90 else 0
+                    seq += 1
+                    yield tick, track_index, seq, NOTE, byte & 0x0F, note, velocity
+                pos += CHANNEL_DATA_LENGTH[kind]
+    except IndexError:
+        pass  # Truncated track: keep what was decoded
+    yield tick, track_index, seq + 1, TRACK_END, 0, 0, 0
+
+
+def _decode_text(raw):
+    try:
+        return raw.decode('utf-8').strip()
+    except UnicodeDecodeError:
+        return raw.decode('latin-1').strip()
+
+
+class MidiNoteStream:
+    """Note events of a Standard MIDI File, merged across tracks in time order.
+
+    Tracks are decoded straight from a memory-mapped file one event at a
+    time and merged with a heap on absolute ticks, so memory stays flat
+    regardless of file size. Iterating yields (seconds, channel, note,
+    velocity) with velocity 0 for note-offs, timed with the file's tempo
+    map; iter_notes(with_tracks=True) adds the track index. Meta, control
+    and sysex events are skipped without being built. length, track_count
+    and track_names ({track: name}) are set once iteration has finished.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.length = None
+        self.track_count = 0
+        self.track_names = {}
+        with open(filepath, 'rb') as f:
+            header = f.read(14)
+        if len(header) < 14 or header[:4] != b'MThd':
+            raise ValueError(f"{filepath} is not a MIDI file")
+        self.type = int.from_bytes(header[8:10], 'big')
+        self.division = int.from_bytes(header[12:14], 'big')
+        if self.type == 2:
+            raise TypeError("can't merge tracks in type 2 (asynchronous) file")
+        self.header_length = int.from_bytes(header[4:8], 'big')
+
+    def _seconds_per_tick(self, tempo):
+        if self.division & 0x8000:
+            # SMPTE timing: negative frames per second and ticks per frame, tempo is ignored
+            frames_per_second = 256 - (self.division >> 8)
+            return 1.0 / (frames_per_second * (self.division & 0xFF))
+        return tempo / 1e6 / self.division
+
+    def _track_chunks(self, data):
+        pos = 8 + self.header_length
+        size = len(data)
+        while pos + 8 <= size:
+            chunk_length = int.from_bytes(data[pos + 4:pos + 8], 'big')
+            start = pos + 8
+            if data[pos:pos + 4] == b'MTrk':
+                yield start, min(start + chunk_length, size)
+            pos = start + chunk_length
+
+    def __iter__(self):
+        return self.iter_notes()
+
+    def iter_notes(self, with_tracks=False):
+        with open(self.filepath, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            tracks = [_track_events(data, start, end, index)
+                      for index, (start, end) in enumerate(self._track_chunks(data))]
+            seconds_per_tick = self._seconds_per_tick(DEFAULT_TEMPO)
+            last_tick = 0
+            seconds = 0.0
+            for tick, track, _, kind, a, b, c in heapq.merge(*tracks):
+                if tick != last_tick:
+                    seconds += (tick - last_tick) * seconds_per_tick
+                    last_tick = tick
+                if kind == NOTE:
+                    yield (seconds, track, a, b, c) if with_tracks else (seconds, a, b, c)
+                elif kind == TEMPO:
+                    seconds_per_tick = self._seconds_per_tick(a)
+                elif kind == TRACK_NAME:
+                    self.track_names[track] = _decode_text(a)
+            self.length = seconds
+            self.track_count = len(tracks)
+        finally:
+            data.close()
+
+
+class MidiParts:
+    """Note events of a MIDI file decoded once into columns, each tagged with its part.
+
+    A part is one channel of one track, with id track * CHANNEL_COUNT +
+    channel. select() drops excluded tracks and channels with a C-level
+    compress() over the part column, so the result is still in merged time
+    order and changing the selection never re-reads the file.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.times = array('d')
+        self.parts = array('H')
+        self.channels = array('B')
+        self.notes = array('B')
+        self.velocities = array('B')
+        stream = MidiNoteStream(filepath)
+        for seconds, track, channel, note, velocity in stream.iter_notes(with_tracks=True):
+            if note > 127:
+                continue
+            self.times.append(seconds)
+            self.parts.append(track * CHANNEL_COUNT + channel)
+            self.channels.append(channel)
+            self.notes.append(note)
+            self.velocities.append(velocity)
+        self.length = stream.length
+        self.track_count = stream.track_count
+        self.track_names = stream.track_names
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def nbytes(self):
+        return sum(column.itemsize * len(column)
+                   for column in (self.times, self.parts, self.channels, self.notes, self.velocities))
+
+    def select(self, excluded_tracks=(), excluded_channels=()):
+        """(times, channels, notes, velocities) columns without the excluded tracks and channels."""
+        columns = (self.times, self.channels, self.notes, self.velocities)
+        if not excluded_tracks and not excluded_channels:
+            return columns
+        included = bytes(track not in excluded_tracks and channel not in excluded_channels
+                         for track in range(self.track_count) for channel in range(CHANNEL_COUNT))
+        keep = bytes(map(included.__getitem__, self.parts))
+        return tuple(array(column.typecode, compress(column, keep)) for column in columns)
@@ -0,0 +1,224 @@
+import sys
+import time
+import json
+import ctypes
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from contextlib import contextmanager
+
+DEFAULT_SPIN_BUDGET_MS = 2.0
+# Longest single sleep, so stop requests are noticed during long rests
+MAX_SLEEP_SLICE_NS = 50_000_000
+DEFAULT_PROGRESS_RATE_HZ = 20
+
+ProgressSnapshot = namedtuple('ProgressSnapshot', [
+    'playing', 'paused', 'position', 'length', 'elapsed', 'remaining',
+    'notes_sent', 'notes_dropped', 'lateness_ms'
+])
+IDLE_PROGRESS = ProgressSnapshot(False, False, 0.0, 0.0, 0.0, 0.0, 0, 0, 0.0)
+
+
+@contextmanager
+def high_resolution_timer():
+    """Raise the Windows timer resolution to 1 ms for the duration of playback."""
+    if sys.platform != 'win32':
+        yield
+        return
+    winmm = ctypes.windll.winmm
+    winmm.timeBeginPeriod(1)
+    try:
+        yield
+    finally:
+        winmm.timeEndPeriod(1)
+
+
+class PlaybackClock:
+    """Absolute-deadline timeline on the monotonic perf_counter_ns clock.
+
+    Event times are plan seconds; the speed multiplier scales the timeline
+    itself, so deadlines never accumulate rounding or oversleep error.
+    Waiting sleeps coarsely until spin_budget_ms before the deadline and
+    busy-waits the rest. A clock that is not realtime never waits, for
+    headless runs against a non-realtime output backend. Pausing freezes the
+    timeline and seeking moves it to any plan time, paused or not.
+    """
+
+    def __init__(self, speed_multiplier=1.0, spin_budget_ms=DEFAULT_SPIN_BUDGET_MS, realtime=True):
+        if speed_multiplier <= 0:
+            raise ValueError("speed_multiplier must be positive")
+        self.ns_per_second = 1_000_000_000 / speed_multiplier
+        self.spin_budget_ns = int(max(spin_budget_ms, 0.0) * 1_000_000)
+        self.realtime = realtime
+        self.start_ns = None
+        self.paused_ns = None
+
+    def start(self):
+        self.start_ns = time.perf_counter_ns()
+        self.paused_ns = None
+        return self.start_ns
+
+    def deadline_ns(self, event_time):
+        return self.start_ns + int(event_time * self.ns_per_second)
+
+    def elapsed(self):
+        """Elapsed playback time in plan seconds, not counting time spent paused."""
+        now = self.paused_ns if self.paused_ns is not None else time.perf_counter_ns()
+        return (now - self.start_ns) / self.ns_per_second
+
+    @property
+    def paused(self):
+        return self.paused_ns is not None
+
+    def pause(self):
+        if self.paused_ns is None:
+            self.paused_ns = time.perf_counter_ns()
+
+    def resume(self):
+        if self.paused_ns is not None:
+            self.start_ns += time.perf_counter_ns() - self.paused_ns
+            self.paused_ns = None
+
+    def seek(self, event_time):
+        """Move the timeline so event_time is now (or where a paused clock resumes)."""
+        now = self.paused_ns if self.paused_ns is not None else time.perf_counter_ns()
+        self.start_ns = now - int(event_time * self.ns_per_second)
+
+    def wait_until(self, deadline_ns, should_stop=None):
+        """Block until deadline_ns. Returns False if should_stop() became true first."""
+        if not self.realtime:
+            return should_stop is None or not should_stop()
+        perf_counter_ns = time.perf_counter_ns
+        spin_budget_ns = self.spin_budget_ns
+        remaining = deadline_ns - perf_counter_ns()
+        while remaining > spin_budget_ns:
+            if should_stop is not None and should_stop():
+                return False
+            time.sleep(min(remaining - spin_budget_ns, MAX_SLEEP_SLICE_NS) / 1e9)
+            remaining = deadline_ns - perf_counter_ns()
+        while perf_counter_ns() < deadline_ns:
+            pass
+        return True
+
+
+class PlaybackProgress:
+    """Progress of the current playback, published at a fixed rate for polling.
+
+    The playback thread replaces snapshot with a new immutable
+    ProgressSnapshot at most once per interval; readers such as a GUI timer
+    just read the attribute. Swapping one reference needs no lock, and the
+    playback thread never waits on the reader. position and length are file
+    seconds, elapsed and remaining are wall-clock seconds at the current speed.
+    """
+
+    def __init__(self, rate_hz=DEFAULT_PROGRESS_RATE_HZ):
+        self.interval_ns = int(1_000_000_000 / rate_hz)
+        self.snapshot = IDLE_PROGRESS
+
+    def publish(self, playing, paused, position, length, speed_multiplier, notes_sent, notes_dropped, lateness_ms):
+        position = min(max(position, 0.0), length)
+        self.snapshot = ProgressSnapshot(playing, paused, position, length, position / speed_multiplier,
+                                         (length - position) / speed_multiplier, notes_sent, notes_dropped,
+                                         lateness_ms)
+
+    @property
+    def fraction(self):
+        snapshot = self.snapshot
+        return snapshot.position / snapshot.length if snapshot.length else 0.0
+
+
+class LatencyRecorder:
+    """Preallocated scheduled/actual send timestamps for one playback run.
+
+    The hot loop writes straight into the arrays by batch index; nothing is
+    allocated until report() runs after playback. Every key event in a batch
+    goes out in the same send call, so they share one timestamp pair.
+    Without a realtime clock nothing waits for its deadline, so the report
+    leaves lateness and backlog out.
+    """
+
+    def __init__(self, capacity, realtime=True):
+        self.scheduled_ns = array('q', bytes(8 * capacity))
+        self.sent_ns = array('q', bytes(8 * capacity))
+        self.count = 0
+        self.callback_ns = 0
+        self.realtime = realtime
+
+    def report(self, filename, completed, key_events=0):
+        return PlaybackReport.from_recorder(self, filename, completed, key_events)
+
+
+class PlaybackReport:
+    """Timing summary of one play_midi run; truthy only if playback completed.
+
+    lateness_ms and longest_backlog are None for runs that were not realtime.
+    """
+
+    def __init__(self, filename, completed, batches=0, key_events=0, lateness_ms=None,
+                 longest_backlog=0, callback_ms=0.0, duration_s=0.0, realtime=True):
+        self.filename = filename
+        self.completed = completed
+        self.batches = batches
+        self.key_events = key_events
+        self.realtime = realtime
+        if realtime:
+            self.lateness_ms = lateness_ms or {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+            self.longest_backlog = longest_backlog
+        else:
+            self.lateness_ms = self.longest_backlog = None
+        self.callback_ms = callback_ms
+        self.duration_s = duration_s
+
+    @classmethod
+    def from_recorder(cls, recorder, filename, completed, key_events=0):
+        count = recorder.count
+        scheduled = recorder.scheduled_ns
+        sent = recorder.sent_ns
+        if not recorder.realtime:
+            # Sends never waited for their deadlines, so only counts and the run time mean anything
+            duration_s = (sent[count - 1] - sent[0]) / 1e9 if count else 0.0
+            return cls(filename, completed, count, key_events, callback_ms=recorder.callback_ns / 1e6,
+                       duration_s=duration_s, realtime=False)
+        lateness = sorted(sent[i] - scheduled[i] for i in range(count))
+        lateness_ms = {}
+        if lateness:
+            for name, fraction in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+                lateness_ms[name] = lateness[min(count - 1, int(count * fraction))] / 1e6
+            lateness_ms['max'] = lateness[-1] / 1e6
+        # Backlog: how many later batches were already due when a send finished
+        longest_backlog = 0
+        for index in range(count):
+            due = bisect_right(scheduled, sent[index], index + 1, count) - index - 1
+            if due > longest_backlog:
+                longest_backlog = due
+        duration_s = (sent[count - 1] - scheduled[0]) / 1e9 if count else 0.0
+        return cls(filename, completed, count, key_events, lateness_ms, longest_backlog,
+                   recorder.callback_ns / 1e6, duration_s)
+
+    def __bool__(self):
+        return self.completed
+
+    def to_dict(self):
+        return {
+            'filename': self.filename,
+            'completed': self.completed,
+            'batches': self.batches,
+            'key_events': self.key_events,
+            'realtime': self.realtime,
+            'lateness_ms': self.lateness_ms,
+            'longest_backlog': self.longest_backlog,
+            'callback_ms': self.callback_ms,
+            'duration_s': self.duration_s,
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    def summary(self):
+        if not self.realtime:
+            return f"{self.key_events} keys, not realtime, callbacks {self.callback_ms:.1f} ms"
+        lateness = self.lateness_ms
+        return (f"{self.key_events} keys, late p50 {lateness['p50']:.2f} / p95 {lateness['p95']:.2f} / "
+                f"p99 {lateness['p99']:.2f} / max {lateness['max']:.2f} ms, backlog {self.longest_backlog}, "
+                f"callbacks {self.callback_ms:.1f} ms")
@@ -0,0 +1,91 @@
+import os
+import time
+import threading
+
+# Quiet period after the last change before settings are written
+DEFAULT_WRITE_DELAY = 0.5
+
+
+def atomic_write_text(path, text):
+    """Write text to path through a temporary file and rename, so readers never see a partial file."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class DebouncedWriter:
+    """Writes the latest text for one file from a background thread.
+
+    write() only records the text and returns; a worker thread writes it
+    once no new text has arrived for delay seconds, so a burst of changes
+    costs one atomic disk write. flush() writes anything pending right away
+    on the calling thread and waits for a write already in progress, for
+    shutdown.
+    """
+
+    def __init__(self, path, delay=DEFAULT_WRITE_DELAY):
+        self.path = path
+        self.delay = delay
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._pending = None
+        self._version = 0
+        self._written_version = 0
+        self._due = 0.0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"DebouncedWriter({path})", daemon=True)
+        self._thread.start()
+
+    def write(self, text):
+        with self._condition:
+            self._version += 1
+            self._pending = (self._version, text)
+            self._due = time.monotonic() + self.delay
+            self._condition.notify()
+
+    def flush(self):
+        with self._condition:
+            pending, self._pending = self._pending, None
+        # Taking the write lock also waits out a write the worker has already picked up
+        with self._write_lock:
+            if pending is not None:
+                self._store(*pending)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                while not self._closed:
+                    remaining = self._due - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._closed:
+                    return
+                pending, self._pending = self._pending, None
+                # Locked before the text leaves _pending, so flush() never misses it
+                self._write_lock.acquire()
+            try:
+                if pending is not None:
+                    self._store(*pending)
+            finally:
+                self._write_lock.release()
+
+    def _store(self, version, text):
+        """Write text unless a newer version is already on disk; the caller holds _write_lock."""
+        if version <= self._written_version:
+            return
+        self._written_version = version
+        try:
+            atomic_write_text(self.path, text)
+        except OSError as e:
+            print(f"Error saving {self.path}: {e}")
@@ -0,0 +1,168 @@
+"""Measure XTest backend send-to-receive latency against an X server (e.g. Xvfb).
+
+    python xtest_latency.py --start-xvfb --count 500
+
+Opens a listener window on its own display connection, presses every
+keymap key through XTestBackend and times how long each KeyPress takes to
+arrive.
+"""
+import os
+import sys
+import json
+import time
+import ctypes
+import argparse
+import subprocess
+from keycodes import SCANCODE_MAP, KEYEVENTF_EXTENDEDKEY
+from keyoutput import XTestBackend, chord_sequences, load_xlib
+
+KeyPress = 2
+KeyPressMask = 1 << 0
+KeyReleaseMask = 1 << 1
+RevertToParent = 2
+
+
+class XKeyEvent(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_int),
+        ('serial', ctypes.c_ulong),
+        ('send_event', ctypes.c_int),
+        ('display', ctypes.c_void_p),
+        ('window', ctypes.c_ulong),
+        ('root', ctypes.c_ulong),
+        ('subwindow', ctypes.c_ulong),
+        ('time', ctypes.c_ulong),
+        ('x', ctypes.c_int),
+        ('y', ctypes.c_int),
+        ('x_root', ctypes.c_int),
+        ('y_root', ctypes.c_int),
+        ('state', ctypes.c_uint),
+        ('keycode', ctypes.c_uint),
+        ('same_screen', ctypes.c_int),
+    ]
+
+
+class XEvent(ctypes.Union):
+    _fields_ = [('type', ctypes.c_int), ('xkey', XKeyEvent), ('pad', ctypes.c_long * 24)]
+
+
+class KeyListener:
+    """A mapped, focused window that reports the keycodes it receives."""
+
+    def __init__(self, display_name):
+        x11, _ = load_xlib()
+        self.x11 = x11
+        x11.XDefaultRootWindow.argtypes = (ctypes.c_void_p,)
+        x11.XDefaultRootWindow.restype = ctypes.c_ulong
+        x11.XCreateSimpleWindow.argtypes = (ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_int,
+                                            ctypes.c_uint, ctypes.c_uint, ctypes.c_uint, ctypes.c_ulong,
+                                            ctypes.c_ulong)
+        x11.XCreateSimpleWindow.restype = ctypes.c_ulong
+        x11.XSelectInput.argtypes = (ctypes.c_void_p, ctypes.c_ulong, ctypes.c_long)
+        x11.XMapRaised.argtypes = (ctypes.c_void_p, ctypes.c_ulong)
+        x11.XSetInputFocus.argtypes = (ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_ulong)
+        x11.XSync.argtypes = (ctypes.c_void_p, ctypes.c_int)
+        x11.XNextEvent.argtypes = (ctypes.c_void_p, ctypes.POINTER(XEvent))
+        x11.XPending.argtypes = (ctypes.c_void_p,)
+        self.display = x11.XOpenDisplay(display_name.encode() if display_name else None)
+        if not self.display:
+            raise OSError(f"Cannot open X display {display_name}")
+        root = x11.XDefaultRootWindow(self.display)
+        self.window = x11.XCreateSimpleWindow(self.display, root, 0, 0, 200, 200, 0, 0, 0)
+        x11.XSelectInput(self.display, self.window, KeyPressMask | KeyReleaseMask)
+        x11.XMapRaised(self.display, self.window)
+        x11.XSync(self.display, 0)
+        time.sleep(0.2)
+        x11.XSetInputFocus(self.display, self.window, RevertToParent, 0)
+        x11.XSync(self.display, 0)
+        self.event = XEvent()
+
+    def wait_for_press(self, keycode):
+        while True:
+            self.x11.XNextEvent(self.display, ctypes.byref(self.event))
+            if self.event.type == KeyPress and self.event.xkey.keycode == keycode:
+                return time.perf_counter_ns()
+
+    def drain(self):
+        while self.x11.XPending(self.display):
+            self.x11.XNextEvent(self.display, ctypes.byref(self.event))
+
+    def close(self):
+        self.x11.XCloseDisplay(self.display)
+
+
+def start_xvfb(display_name):
+    process = subprocess.Popen(['Xvfb', display_name, '-nolisten', 'tcp'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    socket_path = f"/tmp/.X11-unix/X{display_name.lstrip(':').split('.')[0]}"
+    deadline = time.time() + 10
+    while not os.path.exists(socket_path):
+        if process.poll() is not None or time.time() > deadline:
+            process.kill()
+            raise RuntimeError("Xvfb did not start")
+        time.sleep(0.05)
+    return process
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def measure(display_name, count):
+    backend = XTestBackend(display_name)
+    listener = KeyListener(display_name)
+    keys = []
+    for scancode in SCANCODE_MAP.values():
+        key = (scancode & 0xFF, KEYEVENTF_EXTENDEDKEY if scancode > 0xFF else 0)
+        if key in backend.keycodes:
+            keys.append(key)
+    latencies = []
+    try:
+        for index in range(count):
+            scancode, flags = keys[index % len(keys)]
+            down, up = chord_sequences(((scancode, flags),))
+            down, up = backend.prepare(down), backend.prepare(up)
+            sent = time.perf_counter_ns()
+            backend.send(down)
+            received = listener.wait_for_press(backend.keycodes[(scancode, flags)])
+            latencies.append(received - sent)
+            backend.send(up)
+            listener.drain()
+    finally:
+        listener.close()
+        backend.close()
+    latencies.sort()
+    return {
+        'count': len(latencies),
+        'p50_us': percentile(latencies, 0.50) / 1000,
+        'p95_us': percentile(latencies, 0.95) / 1000,
+        'p99_us': percentile(latencies, 0.99) / 1000,
+        'max_us': latencies[-1] / 1000 if latencies else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--display', default=os.environ.get('DISPLAY', ':99'))
+    parser.add_argument('--start-xvfb', action='store_true', help="start a private Xvfb on --display")
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--json', help="also write the result to this file")
+    args = parser.parse_args()
+    xvfb = start_xvfb(args.display) if args.start_xvfb else None
+    try:
+        result = measure(args.display, args.count)
+    finally:
+        if xvfb:
+            xvfb.terminate()
+    print(f"{result['count']} key presses: p50 {result['p50_us']:.0f} us, p95 {result['p95_us']:.0f} us, "
+          f"p99 {result['p99_us']:.0f} us, max {result['max_us']:.0f} us")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=4)
+    return 0 if result['count'] == args.count else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())